@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from typing import List, Optional, Literal
-import json, time
+import time
+import orjson
 from datetime import datetime, timezone
 from fastapi import FastAPI
 from ..models.model import HistoryResponse, HistoryItem, ChatListItem
@@ -12,11 +13,14 @@ from ..services.redis_service import (
     redis_client,
     redis_key,
     chat_meta_key,
+    get_chat_meta,
+    set_chat_meta,
     is_orphan,
     get_last_answer,
     to_iso,
     CHAT_ORDER_ZSET,
     remove_chat_order_member,
+    delete_session as redis_delete_session,
     delete_all_sessions as redis_delete_all_sessions
 )
 
@@ -26,16 +30,15 @@ router = APIRouter(prefix="/chats", tags=["chats"])
 @router.get("/{chat_id}", response_model=HistoryResponse)
 async def get_history(chat_id: str, chat_type: Literal["question", "insight"]):
     key = redis_key(chat_id, chat_type)
-    raw = redis_client.lrange(key, 0, -1)
+    raw = await redis_client.lrange(key, 0, -1)
 
     user_id = "admin"
     chat_title: Optional[str] = None
     document_ids: List[str] = []          # <-- added
 
-    meta_raw = redis_client.get(chat_meta_key(chat_id, chat_type))
-    if meta_raw:
+    meta = await get_chat_meta(chat_id, chat_type)
+    if meta:
         try:
-            meta = json.loads(meta_raw)
             user_id = meta.get("user_id", user_id)
             chat_title = meta.get("title")
             if isinstance(meta.get("document_ids"), list):
@@ -45,7 +48,7 @@ async def get_history(chat_id: str, chat_type: Literal["question", "insight"]):
 
     if not chat_title and raw:
         try:
-            first = json.loads(raw[0])
+            first = orjson.loads(raw[0])
             q = first.get("question", "").strip()
             chat_title = (q[:60] + "...") if len(q) > 60 else q or "Conversation"
         except Exception:
@@ -54,7 +57,7 @@ async def get_history(chat_id: str, chat_type: Literal["question", "insight"]):
     history_items: List[HistoryItem] = []
     for r in raw:
         try:
-            data = json.loads(r)
+            data = orjson.loads(r)
             if "user_id" in data and user_id == "admin":
                 user_id = data["user_id"]
             data.pop("user_id", None)
@@ -67,16 +70,16 @@ async def get_history(chat_id: str, chat_type: Literal["question", "insight"]):
         except Exception:
             continue
 
-    if not meta_raw:
+    if not meta:
         meta_save = {
             "title": chat_title or "Conversation",
             "created": iso_utc_now(),
             "user_id": user_id,
             "document_ids": document_ids    # <-- ensure field present
         }
-        redis_client.set(chat_meta_key(chat_id, chat_type), json.dumps(meta_save))
+        await set_chat_meta(chat_id, chat_type, meta_save)
 
-    return HistoryResponse(
+    response = HistoryResponse(
         chat_id=chat_id,
         chat_type=chat_type,
         user_id=user_id,
@@ -84,8 +87,9 @@ async def get_history(chat_id: str, chat_type: Literal["question", "insight"]):
         history=history_items,
         document_ids=document_ids          # <-- added
     )
+    # Returning a Response bypasses the response_model round trip; pydantic-core writes the JSON itself
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
-# update_chat_meta_on_message imported from redis_service
 # list_chats and delete_session unchanged but now use redis_service helpers
 @router.get("/", response_model=List[ChatListItem])
 async def list_chats(include_insight: bool = True, include_question: bool = True):
@@ -101,7 +105,7 @@ async def list_chats(include_insight: bool = True, include_question: bool = True
 
 
     try:
-        members = redis_client.zrevrange(CHAT_ORDER_ZSET, 0, -1, withscores=True)
+        members = await redis_client.zrevrange(CHAT_ORDER_ZSET, 0, -1, withscores=True)
     except Exception:
         members = []
 
@@ -117,18 +121,20 @@ async def list_chats(include_insight: bool = True, include_question: bool = True
         uniq = f"{chat_type}:{chat_id}"
         if uniq in seen:
             continue
-        if is_orphan(chat_type, chat_id):
-            remove_chat_order_member(chat_id, chat_type)
+        if await is_orphan(chat_type, chat_id):
+            await remove_chat_order_member(chat_id, chat_type)
             continue
         seen.add(uniq)
 
-        meta_raw = redis_client.get(chat_meta_key(chat_id, chat_type))
         title = None
         last_activity_iso = to_iso(score)
 
-        if meta_raw:
+        try:
+            meta = await get_chat_meta(chat_id, chat_type, "title", "last_activity")
+        except Exception:
+            meta = {}
+        if meta:
             try:
-                meta = json.loads(meta_raw)
                 title = meta.get("title") or title
                 la = meta.get("last_activity")
                 if la is not None:
@@ -137,10 +143,10 @@ async def list_chats(include_insight: bool = True, include_question: bool = True
                 pass
 
         if not title:
-            first_raw = redis_client.lindex(redis_key(chat_id, chat_type), 0)
+            first_raw = await redis_client.lindex(redis_key(chat_id, chat_type), 0)
             if first_raw:
                 try:
-                    first = json.loads(first_raw)
+                    first = orjson.loads(first_raw)
                     q = first.get("question", "").strip()
                     title = (q[:60] + "...") if q and len(q) > 60 else (q or None)
                 except Exception:
@@ -159,18 +165,18 @@ async def list_chats(include_insight: bool = True, include_question: bool = True
 
     for t in allowed_types:
         pattern = f"chat:{t}:*"
-        for key in redis_client.keys(pattern):
+        for key in await redis_client.keys(pattern):
             chat_id = key.split(f"chat:{t}:")[1]
             uniq = f"{t}:{chat_id}"
             if uniq in seen:
                 continue
-            if is_orphan(t, chat_id):
+            if await is_orphan(t, chat_id):
                 continue
-            last_raw = redis_client.lindex(key, -1)
+            last_raw = await redis_client.lindex(key, -1)
             score_time = time.time()
             if last_raw:
                 try:
-                    last = json.loads(last_raw)
+                    last = orjson.loads(last_raw)
                     ts = last.get("ts")
                     if isinstance(ts, str):
                         try:
@@ -179,37 +185,25 @@ async def list_chats(include_insight: bool = True, include_question: bool = True
                             pass
                 except Exception:
                     pass
-            redis_client.zadd(CHAT_ORDER_ZSET, {f"{t}:{chat_id}": score_time})
+            await redis_client.zadd(CHAT_ORDER_ZSET, {f"{t}:{chat_id}": score_time})
 
     for item in results:
-        if redis_client.exists(chat_meta_key(item.chat_id, "question")):
-            item.last_answer = get_last_answer("question", item.chat_id)
-        elif redis_client.exists(chat_meta_key(item.chat_id, "insight")):
-            item.last_answer = get_last_answer("insight", item.chat_id)
+        if await redis_client.exists(chat_meta_key(item.chat_id, "question")):
+            item.last_answer = await get_last_answer("question", item.chat_id)
+        elif await redis_client.exists(chat_meta_key(item.chat_id, "insight")):
+            item.last_answer = await get_last_answer("insight", item.chat_id)
 
 
     return results
 
 @router.delete("/{chat_id}")
 async def delete_session(chat_id: str, chat_type: Optional[Literal["question","insight"]] = None):
-    deleted_lists = 0
-    deleted_meta = 0
-
-    if chat_type in (None, "question"):
-        deleted_lists += redis_client.delete(redis_key(chat_id, "question"))
-        deleted_meta += redis_client.delete(chat_meta_key(chat_id, "question"))
-        remove_chat_order_member(chat_id, "question")
-
-    if chat_type in (None, "insight"):
-        deleted_lists += redis_client.delete(redis_key(chat_id, "insight"))
-        deleted_meta += redis_client.delete(chat_meta_key(chat_id, "insight"))
-        remove_chat_order_member(chat_id, "insight")
+    result = await redis_delete_session(chat_id, chat_type)
+    deleted_lists = result["deleted_history"]
+    deleted_meta = result["deleted_meta"]
 
     if (deleted_lists + deleted_meta) == 0:
-        if chat_type:
-            remove_chat_order_member(chat_id, chat_type)
-        else:
-            remove_chat_order_member(chat_id, None)
+        # Stale order entries were removed with the rest
         raise HTTPException(status_code=404, detail="Not found")
 
     return {
@@ -226,7 +220,7 @@ async def delete_all_sessions_endpoint():
     """
     Delete all sessions in Redis using the redis service helper.
     """
-    result = redis_delete_all_sessions()
+    result = await redis_delete_all_sessions()
     return {
         "detail": "All sessions deleted",
         "result": result
@@ -1,20 +1,22 @@
+import asyncio
 import uuid
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import Optional
+from typing import List, Optional
 import os
-from ..services.upload_service import process_document
+from ..services.upload_service import process_document, process_documents
 from ..services.redis_service import (
-    update_chat_meta_on_message,
-    add_doc_ids_to_chat_meta,
-    update_chat_order,
-    redis_client,
-    chat_meta_key
+    attach_doc_ids,
+    get_chat_doc_ids
 )
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
 MAX_DOCS_PER_CHAT = int(os.getenv("MAX_DOCS_PER_CHAT", "2"))
 
+# Cap in-flight extractions so bursts of uploads don't pile file bytes up in RAM
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", str((os.cpu_count() or 1) * 2)))
+_UPLOAD_SEM = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
 
 @router.post("/")
 async def upload_file(
@@ -24,22 +26,16 @@ async def upload_file(
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
 
-    chat_id = chat_id or str(uuid.uuid4())
+    chat_id = chat_id or uuid.uuid4().hex
     chat_type = "question"
 
     # Fetch existing document ids for this chat
-    existing_ids = []
     try:
-        meta_raw = redis_client.get(chat_meta_key(chat_id, chat_type))
-        if meta_raw:
-            import json
-            meta_obj = json.loads(meta_raw)
-            if isinstance(meta_obj.get("document_ids"), list):
-                existing_ids = meta_obj["document_ids"]
+        existing_ids = await get_chat_doc_ids(chat_id, chat_type)
     except Exception:
         existing_ids = []
 
-    # Enforce max documents (allow re-upload of an already attached doc silently)
+    # Cheap early reject before doing any processing; the authoritative check is in attach_doc_ids
     if len(existing_ids) >= MAX_DOCS_PER_CHAT:
         raise HTTPException(
             status_code=400,
@@ -47,23 +43,76 @@ async def upload_file(
         )
 
     # Process and get stored document id
-    doc_id = await process_document(file)
+    async with _UPLOAD_SEM:
+        doc_id = await process_document(file)
+
+    # Attach atomically: concurrent uploads to the same chat can't exceed the cap
+    added, total = await attach_doc_ids(chat_id, chat_type, [doc_id], MAX_DOCS_PER_CHAT)
 
     # If doc already present, just acknowledge (do not count twice)
-    if doc_id in existing_ids:
+    if added == 0:
         return {
             "document_id": doc_id,
             "chat_id": chat_id,
             "message": "Document already associated with this chat."
         }
-
-    # Attach new doc id (now guaranteed we are below limit)
-    update_chat_meta_on_message(chat_id, chat_type)
-    add_doc_ids_to_chat_meta(chat_id, chat_type, [doc_id])
-    update_chat_order(chat_type, chat_id)
+    if added < 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum of {MAX_DOCS_PER_CHAT} documents allowed per chat. Remove one or start a new chat."
+        )
 
     return {
         "document_id": doc_id,
         "chat_id": chat_id,
-        "message": f"Document added. {len(existing_ids)+1}/{MAX_DOCS_PER_CHAT} used."
+        "message": f"Document added. {total}/{MAX_DOCS_PER_CHAT} used."
+    }
+
+
+@router.post("/batch")
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    chat_id: Optional[str] = None
+):
+    if not files or any(not f.filename for f in files):
+        raise HTTPException(status_code=400, detail="No file provided")
+
+    # A larger batch can never be attached; rejecting it up front also bounds
+    # how many spooled temp files one request holds at once
+    if len(files) > MAX_DOCS_PER_CHAT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum of {MAX_DOCS_PER_CHAT} documents allowed per chat. Remove one or start a new chat."
+        )
+
+    chat_id = chat_id or uuid.uuid4().hex
+    chat_type = "question"
+
+    # Fetch existing document ids for this chat
+    try:
+        existing_ids = await get_chat_doc_ids(chat_id, chat_type)
+    except Exception:
+        existing_ids = []
+
+    if len(existing_ids) >= MAX_DOCS_PER_CHAT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum of {MAX_DOCS_PER_CHAT} documents allowed per chat. Remove one or start a new chat."
+        )
+
+    # Process and store the whole batch (one Mongo lookup + one bulk upsert);
+    # every file's extraction takes its own upload slot
+    doc_ids = await process_documents(files, _UPLOAD_SEM)
+
+    added, total = await attach_doc_ids(chat_id, chat_type, doc_ids, MAX_DOCS_PER_CHAT)
+    if added < 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum of {MAX_DOCS_PER_CHAT} documents allowed per chat. Remove one or start a new chat."
+        )
+
+    return {
+        "document_ids": doc_ids,
+        "chat_id": chat_id,
+        "message": f"{added} document(s) added. {total}/{MAX_DOCS_PER_CHAT} used."
     }
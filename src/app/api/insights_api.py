@@ -1,9 +1,12 @@
-from fastapi import FastAPI, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Response
 from typing import List
 import os
+import orjson
+import re
 from datetime import datetime
 from dotenv import load_dotenv
-from ..services.mongo_service import connect_to_mongodb
+from ..services.mongo_service import get_collection
+from ..services.redis_service import redis_client
 from ..models.model import InsightResponse
 
 # Load environment variables
@@ -12,11 +15,28 @@ load_dotenv()
 
 router = APIRouter(prefix="/insights", tags=["insights"])
 
+# Serialized GET /insights payload; the ingestion tool deletes it after writing insights
+INSIGHTS_CACHE_KEY = "insights:list:v1"
+INSIGHTS_CACHE_TTL = int(os.getenv("INSIGHTS_CACHE_TTL", "60"))
+INSIGHTS_COLLECTION = os.getenv("insights_collection_name", "insights")
+
+# "YYYY-MM-DDTHH:MM:SS[.ffffff]" with no offset: exactly what fromisoformat().isoformat() returns unchanged
+# (all-zero microseconds are dropped by isoformat, so ".000000" still takes the normalize path)
+_ISO_DATETIME_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.(?!0{6})\d{6})?")
+
 # List insights  (GET /insights)
 @router.get("/", response_model=List[InsightResponse])
 async def get_insights():
-    mongo_client, collection = connect_to_mongodb(os.getenv("insights_collection_name", "insights"))
-    if mongo_client is None or collection is None:
+    try:
+        cached = await redis_client.get(INSIGHTS_CACHE_KEY)
+    except Exception:
+        cached = None
+    if cached:
+        # Already validated and serialized when it was cached
+        return Response(content=cached, media_type="application/json")
+
+    collection = get_collection(INSIGHTS_COLLECTION)
+    if collection is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
     try:
         insights = []
@@ -32,25 +52,31 @@ async def get_insights():
                     }
                 }
             },
+            # Shape rows server-side: only the response fields, already renamed and defaulted
             {
                 "$project": {
-                    "Insight ID": 1,
-                    "insight": 1,
-                    "user_question_short": 1,
-                    "tags": 1,
+                    "_id": 0,
+                    "id": {"$ifNull": ["$Insight ID", ""]},
+                    "insight": {"$ifNull": ["$insight", ""]},
+                    "user_question": {"$ifNull": ["$user_question_short", ""]},
+                    "summary": {"$ifNull": ["$summary", ""]},
+                    "tags": {"$ifNull": ["$tags", ""]},
                     "updatedAt": 1,
-                    "summary": 1,
                     "insight_num": 1  # Include this field in the projection
                 }
             },
-            {"$sort": {"insight_num": 1}}  # Sort by the numeric field
+            {"$sort": {"insight_num": 1}},  # Sort by the numeric field
+            {"$unset": "insight_num"}
         ]
         cursor = collection.aggregate(pipeline)
 
-        for doc in cursor:
+        async for doc in cursor:
             # Process tags
-            raw_tags = doc.get("tags", "")
-            if isinstance(raw_tags, str) and raw_tags.startswith("[") and raw_tags.endswith("]"):
+            # Stored as an array at ingestion (data_ingestion.py --migrate-tags for older rows)
+            raw_tags = doc["tags"]
+            if isinstance(raw_tags, list):
+                tags = raw_tags
+            elif isinstance(raw_tags, str) and raw_tags.startswith("[") and raw_tags.endswith("]"):
                 tags = [t.strip(" '\"") for t in raw_tags[1:-1].split(",") if t.strip(" '\"")]
             else:
                 tags = [t.strip() for t in str(raw_tags).split(",") if t.strip()]
@@ -60,31 +86,35 @@ async def get_insights():
             if isinstance(updated_at_raw, datetime):
                 updated_at_str = updated_at_raw.isoformat()
             elif isinstance(updated_at_raw, str):
-                try:
-                    updated_at_str = datetime.fromisoformat(updated_at_raw).isoformat()
-                except Exception:
-                    updated_at_str = updated_at_raw  # Keep as-is if not ISO
+                if _ISO_DATETIME_RE.fullmatch(updated_at_raw):
+                    updated_at_str = updated_at_raw  # already ISO: no parse/format round trip
+                else:
+                    try:
+                        updated_at_str = datetime.fromisoformat(updated_at_raw).isoformat()
+                    except Exception:
+                        updated_at_str = updated_at_raw  # Keep as-is if not ISO
             else:
                 updated_at_str = ""
 
-            insights.append(
-            InsightResponse(
-                id=doc.get("Insight ID", ""),
-                title=doc.get("insight", ""),
+            insights.append(InsightResponse(
+                id=doc["id"],
+                title=doc["insight"],
                 updatedAt=updated_at_str,
-                insight=doc.get("insight", ""),
-                user_question=doc.get("user_question_short", ""),
-                summary=doc.get("summary", ""),
-            
-                # type=doc.get("type", "DOCUMENT"),
+                insight=doc["insight"],
+                user_question=doc["user_question"],
+                summary=doc["summary"],
                 tags=tags
+            ))
+        try:
+            await redis_client.setex(
+                INSIGHTS_CACHE_KEY,
+                INSIGHTS_CACHE_TTL,
+                orjson.dumps([i.model_dump() for i in insights])
             )
-            )
+        except Exception:
+            pass
         return insights
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if mongo_client:
-            mongo_client.close()
 
 
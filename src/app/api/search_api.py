@@ -1,31 +1,36 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
-from datetime import datetime, timezone
-import os, uuid, json
-from typing import Any
+import asyncio
+import os, re, uuid
+import orjson
+from typing import Any, Optional
 
-from ..services.search_service import document_search, vector_search
+from ..services.search_service import (
+    document_search,
+    build_document_messages,
+    parse_document_answer,
+    AnswerFieldStream,
+    vector_search,
+    fetch_documents,
+    find_best_match,
+    build_vector_messages,
+    vector_result_metadata,
+    CHAT_CONTEXT_MAX_TURNS,
+    VECTOR_FALLBACK_ANSWER,
+)
 from ..models.model import QuestionRequest, SearchResponse
 
 from ..services.redis_service import (
-    redis_client,
-    redis_key,
-    chat_meta_key,
-    build_chat_context,
-    update_chat_meta_on_message,
-    update_chat_order,
-    add_doc_ids_to_chat_meta,
-    push_history_item,  # added
+    load_turn_context,
+    record_turn,
 )
-from ..services.mongo_service import connect_to_mongodb
-from ..services.openai_service import get_client, generate_chat_title
+from ..services.mongo_service import get_collection
+from ..services.openai_service import get_async_client, generate_chat_title, stream_chat_completion
 
 load_dotenv()
 router = APIRouter(tags=["search"])
 
-def iso_utc_now() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-
 FALLBACK_PHRASES = [
     "i cannot answer based on stored knowledge",
     "i cannot answer based on the provided documents",
@@ -35,11 +40,11 @@ FALLBACK_PHRASES = [
     "do not have that specific information"                 # <— added (broader match)
 ]
 
+# One case-insensitive alternation: a single C-level scan, no lower-cased copy of the answer
+_FALLBACK_RE = re.compile("|".join(re.escape(p) for p in FALLBACK_PHRASES), re.IGNORECASE)
+
 def is_fallback_answer(answer: str) -> bool:
-    if not answer:
-        return True
-    low = answer.lower()
-    return any(p in low for p in FALLBACK_PHRASES)
+    return not answer or _FALLBACK_RE.search(answer) is not None
 
 # Helper to ensure tags are list[dict] before storing/returning
 def ensure_tag_objects(raw: Any) -> list[dict]:
@@ -62,148 +67,287 @@ def ensure_tag_objects(raw: Any) -> list[dict]:
             out.append({"name": s, "file_url": default_file_url if s.lower().endswith(".pdf") else ""})
     return out
 
-@router.post("/search", response_model=SearchResponse)
-async def search_question(request: QuestionRequest):
-    chat_id = request.chat_id or str(uuid.uuid4())
-    chat_type = request.chat_type
-    openai_client = get_client()
-    chat_context = build_chat_context(chat_id, chat_type)
+DOC_FALLBACK_ANSWER = "I cannot answer based on the provided documents."
+
+QUESTIONS_COLLECTION = os.getenv("questions_collection_name", "knowledge_bank")
+
+def _short_title(question: str) -> str:
+    """Fallback chat title: the question, cut to 60 chars."""
+    return question if len(question) <= 60 else question[:60] + "..."
+
+async def _load_turn_state(chat_id: str, chat_type: str):
+    """
+    Load what a new turn needs from Redis/Mongo.
+    Returns (doc_ids, chat_context, docs, existing_title); existing_title is None for a new chat.
+    """
+    # Attached doc ids, stored title and recent history (none = first message): one Redis round trip.
+    # Only the last CHAT_CONTEXT_MAX_TURNS turns make it into the prompt; one more is fetched so
+    # _limit_chat_context can tell older history exists (the vector prompt's truncation notice).
+    try:
+        is_first, doc_ids, chat_context, stored_title, first_raw = await load_turn_context(
+            chat_id, chat_type, CHAT_CONTEXT_MAX_TURNS + 1
+        )
+    except Exception:
+        is_first, doc_ids, chat_context, stored_title, first_raw = True, [], "", None, None
+
+    # Title of an existing chat, from what was just read (reused when persisting the turn)
+    existing_title = None
+    if not is_first:
+        existing_title = stored_title
+        if not existing_title:
+            if first_raw:
+                try:
+                    first = orjson.loads(first_raw)
+                    existing_title = _short_title(first.get("question", "").strip()) or "Conversation"
+                except Exception:
+                    existing_title = "Conversation"
+            else:
+                existing_title = "Conversation"
+
+    docs = await fetch_documents(doc_ids) if doc_ids else []
+    return doc_ids, chat_context, docs, existing_title
+
+def _start_title(existing_title: Optional[str], openai_client, question: str) -> "asyncio.Future[str]":
+    """
+    The chat title as a future: the stored title of an existing chat, or (first turn)
+    a generated one. Generation only needs the question, so it runs alongside the search.
+    """
+    if existing_title is None:
+        return asyncio.ensure_future(generate_chat_title(openai_client, question))
+    fut = asyncio.get_running_loop().create_future()
+    fut.set_result(existing_title)
+    return fut
+
+def _discard_title(title_future: "asyncio.Future[str]") -> None:
+    """
+    Called once the turn is over: cancel a title generation nobody will await any more
+    (the search failed, the client went away), and retrieve the error of a failed one
+    so it isn't logged as never retrieved.
+    """
+    if not title_future.done():
+        title_future.cancel()
+    elif not title_future.cancelled():
+        title_future.exception()
 
-    # Determine if this is the first message in this chat
-    list_key = redis_key(chat_id, chat_type)
+async def _persist_turn(
+    chat_id: str,
+    chat_type: str,
+    question: str,
+    answer: str,
+    tags: list[dict],
+    grounded_doc_ids: list[str],
+    follow_up_questions: list[str],
+    title_future: "asyncio.Future[str]",
+    background_tasks: BackgroundTasks
+) -> str:
+    """
+    Resolve the chat title and schedule appending the turn to the chat history
+    (with the chat meta/order refresh) for after the response has been sent.
+    title_future comes from _start_title. Returns the chat title.
+    """
+    # Title logic
     try:
-        is_first = (redis_client.llen(list_key) == 0)
+        title = await title_future
     except Exception:
-        is_first = True
+        title = _short_title(question)
+
+    # History item (follow-ups only on this last item), meta and chat order: one round trip,
+    # off the critical path since the client doesn't need it to read the answer.
+    # grounded_doc_ids always come from this chat's meta, so there is nothing to add there
+    background_tasks.add_task(
+        record_turn,
+        chat_id=chat_id,
+        chat_type=chat_type,
+        title=title,
+        question=question,
+        answer=answer,
+        tags=tags,
+        document_ids=grounded_doc_ids,
+        extra={"follow_up_questions": follow_up_questions} if follow_up_questions else {"follow_up_questions": []}
+    )
+    return title
+
+async def _complete_turn(
+    request: QuestionRequest,
+    chat_id: str,
+    chat_type: str,
+    final_answer: str,
+    has_answer: bool,
+    follow_up_questions: list[str],
+    tags: list[dict],
+    file_names: list[dict],
+    doc_ids: list[str],
+    title_future: "asyncio.Future[str]",
+    background_tasks: BackgroundTasks
+) -> SearchResponse:
+    """
+    Shared tail of /search and /search/stream: sanitize a fallback answer,
+    persist the turn and build the response.
+    """
+    # Sanitize on fallback (has_answer already reflects the fallback-phrase check)
+    if not has_answer:
+        tags = []
+        grounded_doc_ids = []
+        follow_up_questions = []  # no follow-ups on fallback
+    else:
+        grounded_doc_ids = doc_ids if doc_ids else []
+
+    title = await _persist_turn(
+        chat_id, chat_type, request.question, final_answer, tags,
+        grounded_doc_ids, follow_up_questions, title_future, background_tasks
+    )
+
+    return SearchResponse(
+        question=request.question,
+        answer=final_answer,
+        follow_up_questions=follow_up_questions,
+        chat_id=chat_id,
+        chat_type=chat_type,
+        title=title,
+        tags=tags,
+        file_names=file_names
+    )
+
+@router.post("/search", response_model=SearchResponse)
+async def search_question(request: QuestionRequest, background_tasks: BackgroundTasks):
+    chat_id = request.chat_id or uuid.uuid4().hex
+    chat_type = request.chat_type
+    openai_client = get_async_client()
 
     # --- Initialize to avoid UnboundLocalError ---
     has_answer: bool = False
-    used_vector: bool = False
     final_answer: str = ""
     follow_up_questions: list[str] = []
     tags: list[dict] = []   # store exactly as produced
-    doc_ids: list[str] = []
-    file_url = ""
-
-    # Load prior doc ids if stored
-    try:
-        meta_raw = redis_client.get(chat_meta_key(chat_id, chat_type))
-        if meta_raw:
-            meta_obj = json.loads(meta_raw)
-            if isinstance(meta_obj.get("document_ids"), list):
-                doc_ids = meta_obj["document_ids"]
-    except Exception:
-        doc_ids = []
-
-    mongo_client, collection = connect_to_mongodb(os.getenv("questions_collection_name", "knowledge_bank"))
-    if mongo_client is None or collection is None:
-        raise HTTPException(status_code=500, detail="DB connection failed")
+    file_names: list[dict] = []
 
+    doc_ids, chat_context, docs, existing_title = await _load_turn_state(chat_id, chat_type)
+    title_future = _start_title(existing_title, openai_client, request.question)
     try:
         # 1) Document-grounded ONLY if doc_ids exist (no vector fallback)
         if doc_ids:
-            doc_answer, doc_follow, doc_tags, doc_has , file_names = document_search(doc_ids, request, chat_context, openai_client)
+            doc_answer, doc_follow, doc_tags, doc_has , file_names = await document_search(
+                docs, request, chat_context, openai_client
+            )
             final_answer = doc_answer
             follow_up_questions = doc_follow
             tags = doc_tags  # already list[dict] from document_search
             has_answer = doc_has
-            file_url = ""  # document_search does not provide file_url
-            file_names = file_names
 
             # Do NOT run vector search when docs are attached.
             if not has_answer:
                 # Deterministic document-only fallback
-                final_answer = "I cannot answer based on the provided documents."
+                final_answer = DOC_FALLBACK_ANSWER
                 follow_up_questions = []
                 tags = []
-                file_url = ""
+            else:
+                # The model can claim an answer while replying with a fallback phrase
+                has_answer = not is_fallback_answer(final_answer)
         else:
-            # 2) No docs -> use vector search
-            vec_answer, vec_follow, vec_tags, vec_file_url , file_names = vector_search(request, chat_context, openai_client, collection)
+            # 2) No docs -> use vector search (the only path that needs the knowledge bank).
+            # Shared, pooled Motor client: nothing to open or close per request
+            collection = get_collection(QUESTIONS_COLLECTION)
+            if collection is None:
+                raise HTTPException(status_code=500, detail="DB connection failed")
+            vec_answer, vec_follow, vec_tags, _file_url, file_names = await vector_search(
+                request, chat_context, openai_client, collection
+            )
             final_answer = vec_answer
             follow_up_questions = vec_follow
             tags = vec_tags  # list[dict] from vector_search
-            file_url = vec_file_url
             has_answer = not is_fallback_answer(final_answer)
 
-        # Sanitize on fallback
-        if not has_answer or is_fallback_answer(final_answer):
-            tags = []
-            grounded_doc_ids = []
-            follow_up_questions = []  # no follow-ups on fallback
-        else:
-            grounded_doc_ids = doc_ids if doc_ids else []
+        response = await _complete_turn(
+            request, chat_id, chat_type, final_answer, has_answer, follow_up_questions,
+            tags, file_names, doc_ids, title_future, background_tasks
+        )
+    finally:
+        _discard_title(title_future)
+    # Already validated: serialize straight to JSON bytes, skipping FastAPI's response_model pass
+    # (background tasks still run: FastAPI attaches them to a returned Response)
+    return Response(content=response.model_dump_json(), media_type="application/json")
+
+def _sse(event: str, data: dict) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+@router.post("/search/stream")
+async def search_question_stream(request: QuestionRequest, background_tasks: BackgroundTasks):
+    """
+    Same turn as POST /search, delivered as server-sent events:
+    "token" events carry answer text as it is generated, a final "done"
+    event carries the SearchResponse fields (its answer is authoritative,
+    e.g. when a document answer turns out to be a fallback). The turn is
+    persisted once the stream has been sent.
+    """
+    chat_id = request.chat_id or uuid.uuid4().hex
+    chat_type = request.chat_type
+    openai_client = get_async_client()
 
-        # Ensure only the last message has follow-ups: clear previous last item's follow_ups
+    doc_ids, chat_context, docs, existing_title = await _load_turn_state(chat_id, chat_type)
+
+    async def event_stream():
+        title_future = _start_title(existing_title, openai_client, request.question)
         try:
-            if redis_client.llen(list_key) > 0:
-                prev_raw = redis_client.lindex(list_key, -1)
-                if prev_raw:
-                    try:
-                        prev_obj = json.loads(prev_raw)
-                        if prev_obj.get("follow_up_questions"):
-                            prev_obj["follow_up_questions"] = []
-                            redis_client.lset(list_key, -1, json.dumps(prev_obj))
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-
-        # Persist turn with follow-ups on this last item
-        push_history_item(
-            chat_id=chat_id,
-            chat_type=chat_type,
-            question=request.question,
-            answer=final_answer,
-            tags=tags,
-            document_ids=grounded_doc_ids,
-            extra={"follow_up_questions": follow_up_questions} if follow_up_questions else {"follow_up_questions": []}
-        )
+            follow_up_questions: list[str] = []
+            tags: list[dict] = []
+            file_url = ""
+            file_names: list[dict] = []
+            if doc_ids:
+                # Document answers come back as strict JSON: stream the ANSWER value as it is
+                # decoded, then parse the complete reply for follow-ups/has_answer
+                messages, doc_tags = build_document_messages(docs, request, chat_context)
+                answer_stream = AnswerFieldStream()
+                parts: list[str] = []
+                async for delta in stream_chat_completion(
+                    openai_client,
+                    model="gpt-4o",
+                    messages=messages,
+                    temperature=0.4,
+                    max_tokens=900
+                ):
+                    parts.append(delta)
+                    text = answer_stream.feed(delta)
+                    if text:
+                        yield _sse("token", {"text": text})
+                final_answer, follow_up_questions, tags, has_answer, file_names = parse_document_answer(
+                    "".join(parts).strip(), doc_tags
+                )
+                if not has_answer:
+                    final_answer = DOC_FALLBACK_ANSWER
+                else:
+                    has_answer = not is_fallback_answer(final_answer)
+            else:
+                collection = get_collection(QUESTIONS_COLLECTION)
+                if collection is None:
+                    yield _sse("error", {"detail": "DB connection failed"})
+                    return
+                best = await find_best_match(request, openai_client, collection)
 
-        # Title logic
-        meta_key = chat_meta_key(chat_id, chat_type)
-        title = None
-        if is_first:
-            try:
-                title = generate_chat_title(openai_client, request.question)
-            except Exception:
-                title = (request.question[:60] + "...") if len(request.question) > 60 else request.question
-        else:
-            existing = redis_client.get(meta_key)
-            if existing:
-                try:
-                    em = json.loads(existing)
-                    title = em.get("title")
-                except Exception:
-                    pass
-            if not title:
-                first_raw = redis_client.lindex(list_key, 0)
-                if first_raw:
-                    try:
-                        first = json.loads(first_raw)
-                        fq = first.get("question", "").strip()
-                        title = (fq[:60] + "...") if fq and len(fq) > 60 else (fq or "Conversation")
-                    except Exception:
-                        title = "Conversation"
+                if best is None:
+                    final_answer = VECTOR_FALLBACK_ANSWER
+                    yield _sse("token", {"text": final_answer})
                 else:
-                    title = "Conversation"
-
-        update_chat_meta_on_message(chat_id, chat_type, title)
-        if has_answer and grounded_doc_ids:
-            add_doc_ids_to_chat_meta(chat_id, chat_type, grounded_doc_ids)
-        update_chat_order(chat_type, chat_id)
-
-        return SearchResponse(
-            question=request.question,
-            answer=final_answer,
-            follow_up_questions=follow_up_questions,
-            chat_id=chat_id,
-            chat_type=chat_type,
-            title=title,
-            tags=tags,
-            file_url=file_url,
-            file_names=file_names if 'file_names' in locals() else []  # Ensure file_names is included
-        )
-    finally:
-        if mongo_client:
-            mongo_client.close()
+                    parts: list[str] = []
+                    async for delta in stream_chat_completion(
+                        openai_client,
+                        model="gpt-4o",
+                        messages=build_vector_messages(request, chat_context, best),
+                        temperature=0.7,
+                        max_tokens=600
+                    ):
+                        parts.append(delta)
+                        yield _sse("token", {"text": delta})
+                    final_answer = "".join(parts).strip()
+                    follow_up_questions, tags, file_url, file_names = vector_result_metadata(best)
+                has_answer = not is_fallback_answer(final_answer)
+
+            response = await _complete_turn(
+                request, chat_id, chat_type, final_answer, has_answer, follow_up_questions,
+                tags, file_names, doc_ids, title_future, background_tasks
+            )
+            yield _sse("done", response.model_dump())
+        finally:
+            # Also runs when the client disconnects (GeneratorExit at a yield)
+            _discard_title(title_future)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
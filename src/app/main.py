@@ -1,12 +1,38 @@
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from src.app.api.search_api import router as search_router
 from src.app.api.insights_api import router as insights_router
 from src.app.api.chats import router as chats_router
 from src.app.api.file_upload import router as upload_router
-from fastapi import APIRouter
+from src.app.services.mongo_service import close_mongo_client, ensure_indexes
+from src.app.services.upload_service import start_extract_executor, shutdown_extract_executor
+from src.app.services.openai_service import get_async_client
 
-app = FastAPI(title="Unified Service")
+
+# App loggers (uvicorn configures only its own); LOG_LEVEL=DEBUG also logs the LLM prompts
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_extract_executor()
+    await ensure_indexes()
+    # Build the shared OpenAI client now rather than inside the first request
+    try:
+        get_async_client()
+    except Exception:
+        pass  # e.g. no API key: surfaces on the first OpenAI call, as before
+    yield
+    shutdown_extract_executor()
+    close_mongo_client()
+
+
+# orjson for every JSON response body (routes with a response_model are still validated)
+app = FastAPI(title="Unified Service", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS: allow all origins (adjust later for security)
 app.add_middleware(
@@ -16,27 +42,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# wrap existing routers so they are exposed under the /api prefix
-_orig_search_router = search_router
-_orig_insights_router = insights_router
-_orig_chats_router = chats_router
-_orig_upload_router = upload_router
-
-search_router = APIRouter(prefix="/api")
-search_router.include_router(_orig_search_router)
-
-insights_router = APIRouter(prefix="/api")
-insights_router.include_router(_orig_insights_router)
-
-chats_router = APIRouter(prefix="/api")
-chats_router.include_router(_orig_chats_router)
-
-upload_router = APIRouter(prefix="/api")
-upload_router.include_router(_orig_upload_router)
-app.include_router(search_router)
-app.include_router(insights_router)
-app.include_router(chats_router)
-app.include_router(upload_router)
+# expose every router once, under the /api prefix
+app.include_router(search_router, prefix="/api")
+app.include_router(insights_router, prefix="/api")
+app.include_router(chats_router, prefix="/api")
+app.include_router(upload_router, prefix="/api")
 
 @app.get("/health", tags=["health"])
 async def health_check():
@@ -5,7 +5,7 @@ from typing import List, Optional
 
 class QuestionRequest(BaseModel):
     question: str
-    chat_id: Optional[str] = None
+    chat_id: Optional[str] = None  # omitted -> server generates a 32-char hex id (uuid4, no hyphens)
     chat_type: str = "question"
 
 class SearchResponse(BaseModel):
@@ -1,17 +1,68 @@
 import os
-from pymongo import MongoClient
-from typing import Tuple, Optional
+import threading
+import zstandard as zstd
+from bson import Binary
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from typing import Optional, Union
 from dotenv import load_dotenv
 load_dotenv()
 
-def connect_to_mongodb(collection_name: str) -> Tuple[Optional[MongoClient], Optional[object]]:
+# Uploaded document text is stored zstd-compressed to shrink Mongo payloads
+_ZSTD_COMPRESSOR = zstd.ZstdCompressor(level=int(os.getenv("TEXT_ZSTD_LEVEL", "3")))
+_ZSTD_DECOMPRESSOR = zstd.ZstdDecompressor()
+
+_mongo_client: Optional[AsyncIOMotorClient] = None
+_mongo_client_lock = threading.Lock()
+
+def _pool_options() -> dict:
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    }
+
+def get_mongo_client() -> AsyncIOMotorClient:
+    """Process-wide async (Motor) client; the driver pools connections, so reuse it for every request."""
+    global _mongo_client
+    if _mongo_client is None:
+        with _mongo_client_lock:
+            if _mongo_client is None:
+                _mongo_client = AsyncIOMotorClient(os.getenv('mongo_connection_string'), **_pool_options())
+    return _mongo_client
+
+def get_db() -> AsyncIOMotorDatabase:
+    return get_mongo_client()[os.getenv('db_name', 'crda')]
+
+def get_collection(collection_name: str) -> Optional[AsyncIOMotorCollection]:
     try:
-        mongo_uri = os.getenv('mongo_connection_string')
-        client = MongoClient(mongo_uri)
-        db = client[os.getenv('db_name', 'crda')]
-        collection = db[collection_name]
-        return client, collection
+        return get_db()[collection_name]
     except Exception:
-        return None, None
-    
+        return None
+
+async def ensure_indexes() -> None:
+    """Create the indexes the request paths rely on; safe to call on every startup."""
+    upload = get_collection("upload")
+    if upload is None:
+        return
+    try:
+        # Every upload read (dedupe, chat document loads) filters on "id"
+        await upload.create_index("id", unique=True)
+    except Exception:
+        # Existing duplicate ids (or no DB reachable) must not block startup
+        pass
+
+def close_mongo_client() -> None:
+    global _mongo_client
+    if _mongo_client is not None:
+        _mongo_client.close()
+        _mongo_client = None
+
+def compress_text(text: str) -> Binary:
+    return Binary(_ZSTD_COMPRESSOR.compress(text.encode("utf-8")))
 
+def decompress_text(value: Union[bytes, str, None]) -> str:
+    # Documents stored before compression was introduced hold plain strings
+    if not value:
+        return ""
+    if isinstance(value, str):
+        return value
+    return _ZSTD_DECOMPRESSOR.decompress(bytes(value)).decode("utf-8")
@@ -1,28 +1,61 @@
 import os
 import re
-from openai import OpenAI
+from functools import lru_cache
+from typing import AsyncIterator
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
 from fastapi import HTTPException
-from datetime import datetime, timezone
 
+# One client per process: each holds an HTTP connection pool worth reusing across requests
+@lru_cache(maxsize=1)
 def get_client() -> OpenAI:
     return OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-def get_embedding(text: str, client: OpenAI):
+@lru_cache(maxsize=1)
+def get_async_client() -> AsyncOpenAI:
+    # HTTP/2: concurrent completions multiplex over a few kept-alive TLS connections
+    # (SDK default limits/timeouts otherwise)
+    return AsyncOpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        http_client=DefaultAsyncHttpxClient(http2=True)
+    )
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+async def get_embeddings_async(texts: list[str], client: AsyncOpenAI) -> list[list[float]]:
+    """Embed several texts in one request (the endpoint takes up to 2048 inputs); same order as texts."""
     try:
-        resp = client.embeddings.create(model="text-embedding-ada-002", input=text)
-        return resp.data[0].embedding
+        resp = await client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+        return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
     except Exception:
         raise HTTPException(status_code=500, detail="Embedding failed")
 
-def chat_completion(client: OpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 500):
-    return client.chat.completions.create(
+async def get_embedding_async(text: str, client: AsyncOpenAI):
+    return (await get_embeddings_async([text], client))[0]
+
+async def chat_completion(client: AsyncOpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 500):
+    return await client.chat.completions.create(
         model=model,
         messages=messages,
         temperature=temperature,
         max_tokens=max_tokens
     )
 
-def generate_chat_title(client: OpenAI, question: str) -> str:
+async def stream_chat_completion(client: AsyncOpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 500) -> AsyncIterator[str]:
+    """Yield content deltas as the model generates them."""
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+_WHITESPACE_RUN_RE = re.compile(r"\s+")
+
+async def generate_chat_title(client: AsyncOpenAI, question: str) -> str:
     prompt = f"""
 Generate a short (max 7 words) clear, professional title summarizing this chat based ONLY on the first user question below.
 
@@ -31,7 +64,7 @@ Question: {question}
 Return only the title, no quotes, no punctuation at end.
 """
     try:
-        resp = client.chat.completions.create(
+        resp = await client.chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role":"system","content":"You create concise, descriptive chat titles."},
@@ -42,7 +75,7 @@ Return only the title, no quotes, no punctuation at end.
         )
         title = resp.choices[0].message.content.strip()
         title = title.strip('"').strip("'")
-        title = re.sub(r"\s+", " ", title)
+        title = _WHITESPACE_RUN_RE.sub(" ", title)
         if len(title) > 60:
             title = title[:57].rstrip() + "..."
         return title
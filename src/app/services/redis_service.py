@@ -1,19 +1,51 @@
 import os
-import json
+import re
 import time
-import redis
-from datetime import datetime, timezone
-from typing import Optional, List
+import hashlib
+import orjson
+from array import array
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+from typing import Iterator, Optional, List, Tuple
 
 redis_host = os.getenv("REDIS_HOST", "localhost")
 redis_port = int(os.getenv("REDIS_PORT", 6379))
-redis_client = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+
+def _connection_pool(**kwargs) -> redis.BlockingConnectionPool:
+    # Bounded pool: past max_connections callers wait for a free connection instead of failing.
+    # Keepalive/health checks catch connections silently dropped while idle.
+    return redis.BlockingConnectionPool(
+        host=redis_host,
+        port=redis_port,
+        db=0,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=5,
+        socket_keepalive=True,
+        health_check_interval=30,
+        **kwargs
+    )
+
+redis_client = redis.Redis(connection_pool=_connection_pool(decode_responses=True))
+# Own pool without response decoding, for values stored as raw bytes (query embeddings)
+redis_bytes_client = redis.Redis(connection_pool=_connection_pool())
 
 CHAT_ORDER_ZSET = "chat:order"
 DEFAULT_CHAT_TYPES = ["question", "insight"]
 
+# Uploaded document content is immutable per doc_id, so it can be cached freely
+UPLOAD_TEXT_CACHE_TTL = int(os.getenv("UPLOAD_TEXT_CACHE_TTL", "3600"))
+
+_iso_now_cache: Tuple[int, str] = (0, "")
+
 def iso_utc_now() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    # Second resolution, so one formatted stamp serves every call within the same second
+    # (struct_time + C strftime: no datetime/tzinfo objects for a fixed-format stamp)
+    global _iso_now_cache
+    now = int(time.time())
+    if _iso_now_cache[0] != now:
+        _iso_now_cache = (now, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)))
+    return _iso_now_cache[1]
 
 def redis_key(chat_id: str, chat_type: str) -> str:
     return f"chat:{chat_type}:{chat_id}"
@@ -24,127 +56,265 @@ def chat_meta_key(chat_id: str, chat_type: str) -> str:
 def chat_order_member(chat_type: str, chat_id: str) -> str:
     return f"{chat_type}:{chat_id}"
 
-def update_chat_order(chat_type: str, chat_id: str):
+def upload_text_key(doc_id: str) -> str:
+    return f"upload:text:{doc_id}"
+
+async def get_cached_documents(doc_ids: List[str]) -> dict:
+    """
+    Return {doc_id: {"file_name", "text"}} for the doc_ids present in the cache.
+    """
+    if not doc_ids:
+        return {}
     try:
-        redis_client.zadd(CHAT_ORDER_ZSET, {chat_order_member(chat_type, chat_id): time.time()})
+        raws = await redis_client.mget([upload_text_key(d) for d in doc_ids])
+    except Exception:
+        return {}
+    found = {}
+    for doc_id, raw in zip(doc_ids, raws):
+        if raw:
+            try:
+                found[doc_id] = orjson.loads(raw)
+            except Exception:
+                continue
+    return found
+
+async def cache_documents(docs: dict):
+    """Store {doc_id: {"file_name", "text"}} with UPLOAD_TEXT_CACHE_TTL."""
+    if not docs:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for doc_id, doc in docs.items():
+            pipe.setex(upload_text_key(doc_id), UPLOAD_TEXT_CACHE_TTL, orjson.dumps(doc))
+        await pipe.execute()
     except Exception:
         pass
 
-def remove_chat_order_member(chat_id: str, chat_type: Optional[str] = None):
+# A query embedding is a pure function of (model, text); stored as float32 bytes (6 KB for ada-002)
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+
+def embedding_key(model: str, text: str) -> str:
+    return f"emb:{model}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+async def get_cached_embedding(model: str, text: str) -> Optional[array]:
+    try:
+        raw = await redis_bytes_client.get(embedding_key(model, text))
+    except Exception:
+        return None
+    return array("f", raw) if raw else None
+
+async def cache_embedding(model: str, text: str, embedding: array):
+    try:
+        await redis_bytes_client.setex(embedding_key(model, text), EMBEDDING_CACHE_TTL, embedding.tobytes())
+    except Exception:
+        pass
+
+async def remove_chat_order_member(chat_id: str, chat_type: Optional[str] = None):
     try:
         if chat_type:
-            redis_client.zrem(CHAT_ORDER_ZSET, chat_order_member(chat_type, chat_id))
+            await redis_client.zrem(CHAT_ORDER_ZSET, chat_order_member(chat_type, chat_id))
         else:
             members = [chat_order_member(t, chat_id) for t in DEFAULT_CHAT_TYPES]
-            redis_client.zrem(CHAT_ORDER_ZSET, *members)
+            await redis_client.zrem(CHAT_ORDER_ZSET, *members)
     except Exception:
         pass
 
-def is_orphan(chat_type: str, chat_id: str) -> bool:
+async def is_orphan(chat_type: str, chat_id: str) -> bool:
+    # EXISTS counts every key it is given: one round trip for both
+    return await redis_client.exists(redis_key(chat_id, chat_type), chat_meta_key(chat_id, chat_type)) == 0
+
+def _safe_loads(item: str) -> Optional[dict]:
+    try:
+        entry = orjson.loads(item)
+    except orjson.JSONDecodeError:
+        return None
+    return entry if isinstance(entry, dict) else None
+
+def _context_lines(history: List[str]) -> Iterator[str]:
+    # Lazy: callers join straight from it, no intermediate list of lines
     return (
-        not redis_client.exists(redis_key(chat_id, chat_type))
-        and not redis_client.exists(chat_meta_key(chat_id, chat_type))
+        f"User: {e.get('question', '')}\nAssistant: {e.get('answer', '')}"
+        for e in map(_safe_loads, history)
+        if e is not None
     )
 
-def build_chat_context(
+async def load_turn_context(
     chat_id: str,
-    chat_type: Optional[str] = None,
-    max_messages_per_type: int = 50
-) -> str:
+    chat_type: str,
+    max_messages: int
+) -> Tuple[bool, List[str], str, Optional[str], Optional[str]]:
     """
-    Build a plain-text conversation context from last N messages.
-    (No document id handling.)
+    Everything a turn reads from Redis (including what the title logic needs later),
+    in one pipelined round trip.
+    Returns (is_first, document_ids, chat_context built from the last max_messages items,
+    stored title, first history item raw). The first item is only looked up when an
+    existing chat has no stored title; otherwise it is None.
     """
-    keys = []
-    if chat_type:
-        keys.append(redis_key(chat_id, chat_type))
+    list_key = redis_key(chat_id, chat_type)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hmget(chat_meta_key(chat_id, chat_type), ["document_ids", "title"])
+    pipe.lrange(list_key, -max_messages, -1)
+    meta_fields, history = await pipe.execute(raise_on_error=False)
+    if isinstance(history, Exception):
+        raise history
+
+    if isinstance(meta_fields, ResponseError):
+        # Meta still a JSON string: get_chat_meta converts it
+        meta = await get_chat_meta(chat_id, chat_type, "document_ids", "title")
     else:
-        for t in DEFAULT_CHAT_TYPES:
-            keys.append(redis_key(chat_id, t))
+        meta = _decode_meta(dict(zip(("document_ids", "title"), meta_fields)))
+    doc_ids = meta.get("document_ids")
+    if not isinstance(doc_ids, list):
+        doc_ids = []
 
-    parts = []
-    for k in keys:
-        history = redis_client.lrange(k, -max_messages_per_type, -1)
-        for item in history:
-            try:
-                entry = json.loads(item)
-                q = entry.get("question", "")
-                a = entry.get("answer", "")
-                parts.append(f"User: {q}\nAssistant: {a}")
-            except Exception:
-                continue
-    return "\n".join(parts)
+    # Every persisted turn stores a title, so the first item is rarely needed (legacy chats)
+    title = meta.get("title")
+    first_raw = None
+    if history and not title:
+        first_raw = history[0] if len(history) < max_messages else await redis_client.lindex(list_key, 0)
+    return not history, doc_ids, "\n".join(_context_lines(history)), title, first_raw
 
-def get_last_answer(chat_type: str, chat_id: str) -> Optional[str]:
+async def get_last_answer(chat_type: str, chat_id: str) -> Optional[str]:
+    # Kept on the meta hash by record_turn: a plain HGET, nothing to decode
+    try:
+        answer = await redis_client.hget(chat_meta_key(chat_id, chat_type), "last_answer")
+        if answer is not None:
+            return answer
+    except ResponseError:
+        pass  # legacy JSON-string meta
+    except Exception:
+        return None
+    # Chats last written before the field existed
     try:
-        last_raw = redis_client.lindex(redis_key(chat_id, chat_type), -1)
+        last_raw = await redis_client.lindex(redis_key(chat_id, chat_type), -1)
         if last_raw:
-            obj = json.loads(last_raw)
+            obj = orjson.loads(last_raw)
             return obj.get("answer")
     except Exception:
         pass
     return None
 
+# The iso_utc_now format; stored stamps only ever come from it, so the shape is the check
+_ISO_UTC_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z")
+
 def to_iso(val) -> str:
     if isinstance(val, (int, float)):
-        return datetime.fromtimestamp(val, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-    if isinstance(val, str):
-        try:
-            datetime.strptime(val, "%Y-%m-%dT%H:%M:%SZ")
-            return val
-        except Exception:
-            return iso_utc_now()
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(val))
+    if isinstance(val, str) and _ISO_UTC_RE.fullmatch(val):
+        return val
     return iso_utc_now()
 
-def update_chat_meta_on_message(chat_id: str, chat_type: str, title: Optional[str] = None):
-    """
-    Update chat meta (preserves existing document_ids).
-    """
-    key = chat_meta_key(chat_id, chat_type)
-    now_iso = iso_utc_now()
+# Chat meta is a HASH (title, created, last_activity, last_answer, user_id, document_ids as a
+# JSON array) so single fields can be read/written without decoding the rest.
+# Chats created before that hold one JSON string; they are converted on first touch.
+_META_JSON_FIELDS = ("document_ids",)
+
+def _encode_meta(meta: dict) -> dict:
+    return {
+        k: orjson.dumps(v) if k in _META_JSON_FIELDS else str(v)
+        for k, v in meta.items() if v is not None
+    }
+
+def _decode_meta(fields: dict) -> dict:
     meta = {}
-    raw = redis_client.get(key)
-    if raw:
-        try:
-            meta = json.loads(raw)
-        except Exception:
-            meta = {}
-    if "created" not in meta:
-        meta["created"] = now_iso
-    meta["last_activity"] = now_iso
-    if title:
-        meta["title"] = title
-    else:
-        meta.setdefault("title", "Conversation")
-    meta.setdefault("user_id", "admin")
-    # DO NOT remove document_ids anymore (preserve if present)
-    redis_client.set(key, json.dumps(meta))
+    for k, v in fields.items():
+        if v is None:
+            continue
+        if k in _META_JSON_FIELDS:
+            try:
+                v = orjson.loads(v)
+            except Exception:
+                continue
+        meta[k] = v
     return meta
 
-def add_doc_ids_to_chat_meta(chat_id: str, chat_type: str, doc_ids):
-    if not doc_ids:
-        return
-    key = chat_meta_key(chat_id, chat_type)
+async def _migrate_legacy_meta(key: str):
+    raw = await redis_client.get(key)
     try:
-        existing_raw = redis_client.get(key)
-        if existing_raw:
-            try:
-                meta = json.loads(existing_raw)
-            except Exception:
-                meta = {}
-        else:
-            meta = {}
-        existing_ids = set(meta.get("document_ids", []))
-        # Preserve original order where possible, append new ones
-        new_ids = [d for d in doc_ids if d not in existing_ids]
-        if not new_ids:
-            return
-        meta["document_ids"] = meta.get("document_ids", []) + new_ids
-        redis_client.set(key, json.dumps(meta))
+        meta = orjson.loads(raw) if raw else {}
     except Exception:
-        pass
+        meta = {}
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(key)
+    mapping = _encode_meta(meta) if isinstance(meta, dict) else {}
+    if mapping:
+        pipe.hset(key, mapping=mapping)
+    await pipe.execute()
+
+async def _on_meta_hash(key: str, op):
+    """Run op() against the meta hash, converting a legacy JSON-string meta first if needed."""
+    try:
+        return await op()
+    except ResponseError as e:
+        if "WRONGTYPE" not in str(e):
+            raise
+    await _migrate_legacy_meta(key)
+    return await op()
+
+async def get_chat_meta(chat_id: str, chat_type: str, *fields: str) -> dict:
+    """
+    Read chat meta (only the given fields if any). Missing meta -> {}.
+    """
+    key = chat_meta_key(chat_id, chat_type)
 
-def delete_session(
+    async def op():
+        if fields:
+            return dict(zip(fields, await redis_client.hmget(key, fields)))
+        return await redis_client.hgetall(key)
+
+    return _decode_meta(await _on_meta_hash(key, op))
+
+async def get_chat_doc_ids(chat_id: str, chat_type: str) -> List[str]:
+    doc_ids = (await get_chat_meta(chat_id, chat_type, "document_ids")).get("document_ids")
+    return doc_ids if isinstance(doc_ids, list) else []
+
+async def set_chat_meta(chat_id: str, chat_type: str, meta: dict):
+    key = chat_meta_key(chat_id, chat_type)
+    mapping = _encode_meta(meta)
+    if mapping:
+        await _on_meta_hash(key, lambda: redis_client.hset(key, mapping=mapping))
+
+# Attach doc ids to a chat's meta hash and bump it in the chat order, enforcing
+# the per-chat document cap atomically (concurrent uploads can't overshoot it).
+# ARGV: max_docs, now_iso, order member, order score, doc ids...
+# Returns {added, total}; added = -1 when the cap would be exceeded.
+_ATTACH_DOC_IDS = redis_client.register_script("""
+local ids = {}
+local raw = redis.call('HGET', KEYS[1], 'document_ids')
+if raw then
+  local ok, v = pcall(cjson.decode, raw)
+  if ok and type(v) == 'table' then ids = v end
+end
+local seen, new = {}, {}
+for _, d in ipairs(ids) do seen[d] = true end
+for i = 5, #ARGV do
+  local d = ARGV[i]
+  if not seen[d] then seen[d] = true; new[#new + 1] = d end
+end
+if #new == 0 then return {0, #ids} end
+if #ids + #new > tonumber(ARGV[1]) then return {-1, #ids} end
+for _, d in ipairs(new) do ids[#ids + 1] = d end
+redis.call('HSET', KEYS[1], 'document_ids', cjson.encode(ids), 'last_activity', ARGV[2])
+redis.call('HSETNX', KEYS[1], 'created', ARGV[2])
+redis.call('HSETNX', KEYS[1], 'user_id', 'admin')
+redis.call('HSETNX', KEYS[1], 'title', 'Conversation')
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[3])
+return {#new, #ids}
+""")
+
+async def attach_doc_ids(chat_id: str, chat_type: str, doc_ids: List[str], max_docs: int) -> Tuple[int, int]:
+    """
+    Atomically add doc_ids to the chat (meta + order) unless that would exceed max_docs.
+    Returns (added, total); added is -1 if the cap was hit (nothing written).
+    """
+    key = chat_meta_key(chat_id, chat_type)
+    args = [max_docs, iso_utc_now(), chat_order_member(chat_type, chat_id), time.time(), *doc_ids]
+    added, total = await _on_meta_hash(
+        key, lambda: _ATTACH_DOC_IDS(keys=[key, CHAT_ORDER_ZSET], args=args)
+    )
+    return int(added), int(total)
+
+async def delete_session(
     chat_id: str,
     chat_type: Optional[str] = None,
     delete_history: bool = True,
@@ -156,31 +326,30 @@ def delete_session(
     If chat_type is None, applies to all DEFAULT_CHAT_TYPES.
     """
     types = [chat_type] if chat_type else DEFAULT_CHAT_TYPES
-    deleted_history = 0
-    deleted_meta = 0
-    removed_order_entries = 0
 
+    # Everything in one round trip; DEL/ZREM of a missing key is a no-op returning 0
+    pipe = redis_client.pipeline(transaction=False)
+    ops = []
     for t in types:
         if delete_history:
-            k_hist = redis_key(chat_id, t)
-            try:
-                if redis_client.exists(k_hist):
-                    deleted_history += redis_client.delete(k_hist)
-            except Exception:
-                pass
+            pipe.delete(redis_key(chat_id, t))
+            ops.append("history")
         if delete_meta:
-            k_meta = chat_meta_key(chat_id, t)
-            try:
-                if redis_client.exists(k_meta):
-                    deleted_meta += redis_client.delete(k_meta)
-            except Exception:
-                pass
+            pipe.delete(chat_meta_key(chat_id, t))
+            ops.append("meta")
         if remove_order:
-            try:
-                rem = redis_client.zrem(CHAT_ORDER_ZSET, chat_order_member(t, chat_id))
-                removed_order_entries += rem
-            except Exception:
-                pass
+            pipe.zrem(CHAT_ORDER_ZSET, chat_order_member(t, chat_id))
+            ops.append("order")
+    counts = {"history": 0, "meta": 0, "order": 0}
+    if ops:
+        # raise_on_error=False covers per-command errors only; connection/timeout errors propagate,
+        # so callers never mistake an unreachable Redis for "nothing to delete"
+        for op, res in zip(ops, await pipe.execute(raise_on_error=False)):
+            if isinstance(res, int):
+                counts[op] += res
+    deleted_history = counts["history"]
+    deleted_meta = counts["meta"]
+    removed_order_entries = counts["order"]
 
     return {
         "chat_id": chat_id,
@@ -191,7 +360,9 @@ def delete_session(
     }
 
 
-def delete_all_sessions(
+UNLINK_BATCHES_PER_FLUSH = 4
+
+async def delete_all_sessions(
     batch_size: int = 500,
     only_types: Optional[List[str]] = None,
     include_order_zset: bool = True
@@ -216,61 +387,60 @@ def delete_all_sessions(
             return False
         return False
 
-    deleted_lists = 0
-    deleted_meta = 0
+    # UNLINK: keys are dropped from the keyspace at once, their memory freed off Redis's main thread.
+    # Batches are queued on a pipeline and sent a few at a time, so scanning isn't stalled by
+    # one round trip per batch.
+    async def flush(pipe) -> int:
+        if not len(pipe):
+            return 0
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception:
+            return 0
+        return sum(r for r in results if isinstance(r, int))
 
-    try:
-        # chat histories
-        keys_iter = redis_client.scan_iter(match="chat:*:*", count=1000)
+    async def unlink_scanned(match: str, accept) -> int:
+        removed = 0
+        pipe = redis_client.pipeline(transaction=False)
         batch = []
-        for k in keys_iter:
-            if not k.startswith("chatmeta:") and type_allowed(k):
+        async for k in redis_client.scan_iter(match=match, count=1000):
+            if accept(k):
                 batch.append(k)
                 if len(batch) >= batch_size:
-                    try:
-                        deleted_lists += redis_client.delete(*batch)
-                    except Exception:
-                        pass
+                    pipe.unlink(*batch)
                     batch = []
+                    if len(pipe) >= UNLINK_BATCHES_PER_FLUSH:
+                        removed += await flush(pipe)
         if batch:
-            try:
-                deleted_lists += redis_client.delete(*batch)
-            except Exception:
-                pass
+            pipe.unlink(*batch)
+        return removed + await flush(pipe)
+
+    deleted_lists = 0
+    deleted_meta = 0
 
+    try:
+        # chat histories
+        deleted_lists = await unlink_scanned(
+            "chat:*:*", lambda k: not k.startswith("chatmeta:") and type_allowed(k)
+        )
         # chat meta
-        keys_iter = redis_client.scan_iter(match="chatmeta:*:*", count=1000)
-        batch = []
-        for k in keys_iter:
-            if type_allowed(k):
-                batch.append(k)
-                if len(batch) >= batch_size:
-                    try:
-                        deleted_meta += redis_client.delete(*batch)
-                    except Exception:
-                        pass
-                    batch = []
-        if batch:
-            try:
-                deleted_meta += redis_client.delete(*batch)
-            except Exception:
-                pass
+        deleted_meta = await unlink_scanned("chatmeta:*:*", type_allowed)
 
         removed_order = False
-        if include_order_zset and redis_client.exists(CHAT_ORDER_ZSET):
+        if include_order_zset and await redis_client.exists(CHAT_ORDER_ZSET):
             try:
                 if type_filter:
                     # Remove only members whose prefix matches allowed types
-                    members = redis_client.zrange(CHAT_ORDER_ZSET, 0, -1)
+                    members = await redis_client.zrange(CHAT_ORDER_ZSET, 0, -1)
                     to_remove = [
                         m for m in members
                         if m.split(":", 1)[0] in type_filter
                     ]
                     if to_remove:
-                        redis_client.zrem(CHAT_ORDER_ZSET, *to_remove)
+                        await redis_client.zrem(CHAT_ORDER_ZSET, *to_remove)
                         removed_order = True
                 else:
-                    redis_client.delete(CHAT_ORDER_ZSET)
+                    await redis_client.unlink(CHAT_ORDER_ZSET)
                     removed_order = True
             except Exception:
                 pass
@@ -289,20 +459,14 @@ def delete_all_sessions(
             "filtered_types": list(type_filter) if type_filter else None
         }
 
-def push_history_item(
-    chat_id: str,
-    chat_type: str,
+def _history_entry(
     question: str,
     answer: str,
     tags: List[dict],
     document_ids: Optional[List[str]] = None,
     extra: Optional[dict] = None,
     ts: Optional[str] = None
-) -> int:
-    """
-    Append a history item to Redis. Tags are stored as-is (list of dicts).
-    Optionally include follow_up_questions via 'extra'.
-    """
+) -> bytes:
     entry = {
         "question": question,
         "answer": answer,
@@ -312,7 +476,74 @@ def push_history_item(
     }
     if extra:
         entry.update(extra)
-    try:
-        return redis_client.rpush(redis_key(chat_id, chat_type), json.dumps(entry))
-    except Exception:
-        return 0
\ No newline at end of file
+    return orjson.dumps(entry)
+
+# Records a turn in one round trip: refreshes chat meta (including last_answer, which
+# get_last_answer reads back), bumps the chat order, empties
+# follow_up_questions on the current last item (only the newest item carries
+# follow-ups), then RPUSHes the new item. Meta is written first so a legacy
+# JSON-string meta fails with WRONGTYPE before anything else has been written.
+# The follow-up array is located textually (an unescaped quoted key followed by ':'
+# can't occur inside a string value; whitespace is allowed around the ':' because
+# items written by the stdlib json module have "key": [ with a space) and scanned
+# to its closing bracket with string literals skipped; the item is never decoded/re-encoded.
+_RECORD_TURN = redis_client.register_script("""
+redis.call('HSETNX', KEYS[2], 'created', ARGV[2])
+redis.call('HSETNX', KEYS[2], 'user_id', 'admin')
+redis.call('HSET', KEYS[2], 'last_activity', ARGV[2], 'last_answer', ARGV[6])
+if ARGV[5] ~= '' then
+  redis.call('HSET', KEYS[2], 'title', ARGV[5])
+else
+  redis.call('HSETNX', KEYS[2], 'title', 'Conversation')
+end
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[4])
+local raw = redis.call('LINDEX', KEYS[1], -1)
+if raw then
+  local _, e = string.find(raw, '"follow_up_questions"%s*:%s*%[')
+  if e then
+    local i, n, in_str = e + 1, #raw, false
+    while i <= n do
+      local c = string.sub(raw, i, i)
+      if in_str then
+        if c == '\\\\' then i = i + 1 elseif c == '"' then in_str = false end
+      elseif c == '"' then in_str = true
+      elseif c == ']' then break end
+      i = i + 1
+    end
+    if i <= n and i > e + 1 then
+      redis.call('LSET', KEYS[1], -1, string.sub(raw, 1, e) .. string.sub(raw, i))
+    end
+  end
+end
+return redis.call('RPUSH', KEYS[1], ARGV[1])
+""")
+
+async def record_turn(
+    chat_id: str,
+    chat_type: str,
+    title: Optional[str],
+    question: str,
+    answer: str,
+    tags: List[dict],
+    document_ids: Optional[List[str]] = None,
+    extra: Optional[dict] = None
+) -> int:
+    """
+    Append a history item (clearing follow-ups on the previous one), refresh the chat
+    meta (created/user_id if missing, last_activity, last_answer, title) and bump the
+    chat in the chat order, in a single round trip.
+    Returns the new history length.
+    """
+    key = chat_meta_key(chat_id, chat_type)
+    # Encoded up front: nothing but the script call happens per attempt
+    args = [
+        _history_entry(question, answer, tags, document_ids, extra),
+        iso_utc_now(),
+        time.time(),
+        chat_order_member(chat_type, chat_id),
+        title or "",
+        answer
+    ]
+    return await _on_meta_hash(
+        key, lambda: _RECORD_TURN(keys=[redis_key(chat_id, chat_type), key, CHAT_ORDER_ZSET], args=args)
+    )
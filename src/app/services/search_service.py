@@ -1,28 +1,38 @@
+import io
 import os
-import json
+import logging
+import orjson
 import re
-import ast
-from typing import List, Tuple
+import math
+from array import array
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
 
 from click import prompt
-from ..services.mongo_service import connect_to_mongodb
+from ..services.mongo_service import get_collection, decompress_text
+from ..services.redis_service import get_cached_documents, cache_documents, get_cached_embedding, cache_embedding
 from ..models.model import QuestionRequest
-from ..services.openai_service import get_embedding,chat_completion
+from ..services.openai_service import get_embedding_async, chat_completion, EMBEDDING_MODEL
 
 
 
+logger = logging.getLogger(__name__)
+
 json_path = 'config.json'
 if not os.path.exists(json_path):
-    print(f"File not found: {json_path}")
+    logger.warning("File not found: %s", json_path)
 else:
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data1 = json.load(f)
+    with open(json_path, 'rb') as f:
+        data1 = orjson.loads(f.read())
 
 
 # Add: limit previous conversation included in LLM prompts
 CHAT_CONTEXT_MAX_TURNS = int(os.getenv("CHAT_CONTEXT_MAX_TURNS", "3"))
 CHAT_CONTEXT_MAX_CHARS = int(os.getenv("CHAT_CONTEXT_MAX_CHARS", "3000"))
 
+_TURN_SPLIT_RE = re.compile(r"^(?=User:)", re.MULTILINE)
+_DOC_SEPARATOR = "\n\n"
+
 def _limit_chat_context(chat_context: str, max_turns: int = CHAT_CONTEXT_MAX_TURNS, max_chars: int = CHAT_CONTEXT_MAX_CHARS) -> str:
     """
     Keep only the most recent max_turns (User/Assistant pairs) and cap total chars.
@@ -30,18 +40,8 @@ def _limit_chat_context(chat_context: str, max_turns: int = CHAT_CONTEXT_MAX_TUR
     """
     if not chat_context:
         return ""
-    # Split into turn blocks on lines that start with "User:"
-    lines = chat_context.splitlines()
-    blocks = []
-    current = []
-    for line in lines:
-        if line.startswith("User:"):
-            if current:
-                blocks.append("\n".join(current))
-                current = []
-        current.append(line)
-    if current:
-        blocks.append("\n".join(current))
+    # Split into turn blocks on lines that start with "User:" (single regex pass)
+    blocks = [b[:-1] if b.endswith("\n") else b for b in _TURN_SPLIT_RE.split(chat_context) if b]
     recent = blocks[-max_turns:]
     limited = "\n".join(recent).strip()
     if len(limited) > max_chars:
@@ -52,97 +52,185 @@ def _limit_chat_context(chat_context: str, max_turns: int = CHAT_CONTEXT_MAX_TUR
             limited = limited[nl+1:]
     return limited
 
-def document_search(doc_ids: List[str], request: QuestionRequest, chat_context: str, openai_client) -> Tuple[str, List[str], List[dict], bool]:
-    # ----------------- If doc_ids provided: build document context -----------------
-    doc_context_block = "No referenced documents."
-    snippets = []
-    doc_tags = []
-    up_client, up_coll = connect_to_mongodb("upload")
-    if up_client is not None and up_coll is not None:
+async def fetch_documents(doc_ids: List[str]) -> List[dict]:
+    """
+    Load uploaded documents for doc_ids: Redis cache first, "upload" collection for misses.
+    Returns a list of {"file_name", "text"} dicts (text already decompressed), in doc_ids order.
+    """
+    found = await get_cached_documents(doc_ids)
+    missing = [d for d in doc_ids if d not in found]
+    up_coll = get_collection("upload") if missing else None
+    if up_coll is not None:
+        loaded = {}
         try:
-            cur = up_coll.find({"id": {"$in": doc_ids}}, {"id": 1, "file_name": 1, "text": 1})
-            for d in cur:
-                file_name = d.get("file_name") or "Unnamed"
-                if file_name not in doc_tags:
-                    doc_tags.append(file_name)
-                text = (d.get("text", "") or "").strip()
-                snippets.append(f"[DOC {file_name}]\n{text}")
+            # Indexed lookup (unique "id"), projected; to_list(n) reads all n docs in one batch
+            rows = await up_coll.find(
+                {"id": {"$in": missing}},
+                {"_id": 0, "id": 1, "file_name": 1, "text": 1}
+            ).to_list(len(missing))
+            for d in rows:
+                loaded[d.get("id")] = {
+                    "file_name": d.get("file_name") or "Unnamed",
+                    "text": decompress_text(d.get("text")).strip()
+                }
         except Exception:
             pass
-        finally:
-            try:
-                up_client.close()
-            except Exception:
-                pass
-    if snippets:
-        doc_context_block = "\n\n".join(snippets)
+        await cache_documents(loaded)
+        found.update(loaded)
+    return [found[d] for d in doc_ids if d in found]
+
+# Documents larger than this (combined) are cut down to the chunks most relevant to the question
+DOC_CONTEXT_MAX_CHARS = int(os.getenv("DOC_CONTEXT_MAX_CHARS", "60000"))
+DOC_CHUNK_CHARS = int(os.getenv("DOC_CHUNK_CHARS", "4000"))  # ~1000 tokens
+
+_WORD_RE = re.compile(r"\w+")
+_CHUNK_GAP = "\n...\n"
+
+def _chunk_text(text: str, size: int) -> List[str]:
+    """Fixed-size windows, cut at a line break near the end of the window where possible."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            nl = text.rfind("\n", start + size * 4 // 5, end)
+            if nl > start:
+                end = nl + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+def _select_relevant_chunks(docs: List[dict], question: str, max_chars: int = DOC_CONTEXT_MAX_CHARS, chunk_chars: int = DOC_CHUNK_CHARS) -> List[dict]:
+    """
+    Keep whole documents when they fit in max_chars; otherwise keep the top-scoring
+    chunks (BM25-style term overlap with the question) up to max_chars, in document order.
+    """
+    if sum(len(d["text"]) for d in docs) <= max_chars:
+        return docs
+    q_terms = {w for w in _WORD_RE.findall(question.lower()) if len(w) > 2}
+
+    chunks = []  # (doc_idx, chunk_idx, text, term counts)
+    df: Counter = Counter()
+    for di, d in enumerate(docs):
+        for ci, c in enumerate(_chunk_text(d["text"], chunk_chars)):
+            tf = Counter(w for w in _WORD_RE.findall(c.lower()) if w in q_terms)
+            df.update(tf.keys())
+            chunks.append((di, ci, c, tf))
+
+    n = len(chunks)
+    def score(tf: Counter) -> float:
+        return sum(math.log(1 + n / df[t]) * cnt / (cnt + 1.2) for t, cnt in tf.items())
+
+    ranked = sorted(chunks, key=lambda ch: (-score(ch[3]), ch[0], ch[1]))
+    keep = set()
+    used = 0
+    for di, ci, c, _ in ranked:
+        if used + len(c) > max_chars:
+            continue
+        keep.add((di, ci))
+        used += len(c)
+
+    selected: List[List[str]] = [[] for _ in docs]
+    for di, ci, c, _ in chunks:
+        if (di, ci) in keep:
+            selected[di].append(c)
+    return [{**d, "text": _CHUNK_GAP.join(parts)} for d, parts in zip(docs, selected)]
+
+NO_DOCUMENTS_BLOCK = "No referenced documents."
+
+# Static instructions for document answers: identical on every request, so they form a
+# cacheable prompt prefix and are never re-formatted
+DOCUMENT_SYSTEM_PROMPT = """Return ONLY valid JSON matching the required schema.
+
+You are an assistant that answers ONLY from the REFERENCE DOCUMENTS in the user message.
+Documents start with: [DOC <filename>]
+The PREVIOUS CONVERSATION is only for resolving references in the question (e.g. "it", "that file").
+
+Rules:
+1) Metadata questions (what files uploaded, how many, list names): Answer from headers only
+2) Content questions (facts, dates, numbers): Answer only if explicitly stated, cite [DOC <filename>]
+3) Missing facts = HAS_ANSWER: false
+
+Return strict JSON:
+- HAS_ANSWER: boolean
+- ANSWER: either a string or a list of strings (do NOT add numeric ordering)
+- FOLLOW_UP_QUESTIONS: max 3 short user-style QUESTIONS (e.g. "Can you summarize KAG1.pdf?")
+- SOURCES: list of {"id":"<id>","filename":"<name>"}
+
+Examples:
+No answer: { "HAS_ANSWER": false, "ANSWER": "I cannot answer based on the provided documents.", "FOLLOW_UP_QUESTIONS": [], "SOURCES": [] }
+
+Content: { "HAS_ANSWER": true, "ANSWER": ["Fact with evidence [DOC 42]"], "FOLLOW_UP_QUESTIONS": ["Can you summarize the supporting document?"], "SOURCES": [{ "id": "42", "filename": "file.pdf" }] }
+
+Metadata: { "HAS_ANSWER": true, "ANSWER": "You have 2 documents: file1.pdf, file2.docx.", "FOLLOW_UP_QUESTIONS": ["Can you summarize file1.pdf?"], "SOURCES": [{ "id": "1", "filename": "file1.pdf" }] }"""
+
+def build_document_messages(docs: List[dict], request: QuestionRequest, chat_context: str) -> Tuple[List[dict], List[str]]:
+    """Build the document-grounded prompt. Returns (messages, doc_tags)."""
+    # ----------------- Build document context from pre-fetched docs -----------------
+    doc_context_block = NO_DOCUMENTS_BLOCK
+    doc_tags: List[str] = []
+    if docs:
+        # Every document keeps its [DOC] header (metadata questions); oversized text is windowed
+        docs = _select_relevant_chunks(docs, request.question)
+        # Write snippets straight into one buffer instead of building per-doc strings and joining
+        buf = io.StringIO()
+        for i, d in enumerate(docs):
+            if i:
+                buf.write(_DOC_SEPARATOR)
+            buf.write("[DOC ")
+            buf.write(d["file_name"])
+            buf.write("]\n")
+            buf.write(d["text"])
+        doc_context_block = buf.getvalue()
+        # Unique file names in first-seen order (dict keys: no list membership scans)
+        doc_tags = list(dict.fromkeys(d["file_name"] for d in docs))
 
     # LIMIT previous conversation included in prompt
-    chat_context_limited = _limit_chat_context(chat_context)
-    prev_conv = (chat_context_limited or 'None').replace('"', '\\"')
-
-    prompt = f"""
-    You are an assistant that answers ONLY from provided REFERENCE DOCUMENTS below.
-    Documents start with: [DOC <filename>]
-
-    Rules:
-    1) Metadata questions (what files uploaded, how many, list names): Answer from headers only
-    2) Content questions (facts, dates, numbers): Answer only if explicitly stated, cite [DOC <filename>]
-    3) Missing facts = HAS_ANSWER: false
-
-    Return strict JSON:
-    - HAS_ANSWER: boolean
-    - ANSWER: either a string or a list of strings (do NOT add numeric ordering)
-    - FOLLOW_UP_QUESTIONS: max 3 short user-style QUESTIONS (e.g. "Can you summarize KAG1.pdf?")
-    - PREVIOUS_CONVERSATION: "{prev_conv}"
-    - SOURCES: list of {{"id":"<id>","filename":"<name>"}}
+    prev_conv = _limit_chat_context(chat_context) or "None"
 
-    Examples:
-    No answer: {{ "HAS_ANSWER": false, "ANSWER": "I cannot answer based on the provided documents.", "FOLLOW_UP_QUESTIONS": [], "PREVIOUS_CONVERSATION": "{prev_conv}", "SOURCES": [] }}
+    # Only this part varies per request; the rules are the static system message
+    prompt = f"""PREVIOUS CONVERSATION:
+{prev_conv}
 
-    Content: {{ "HAS_ANSWER": true, "ANSWER": ["Fact with evidence [DOC 42]"], "FOLLOW_UP_QUESTIONS": ["Can you summarize the supporting document?"], "PREVIOUS_CONVERSATION": "{prev_conv}", "SOURCES": [{{ "id": "42", "filename": "file.pdf" }}] }}
-
-    Metadata: {{ "HAS_ANSWER": true, "ANSWER": "You have 2 documents: file1.pdf, file2.docx.", "FOLLOW_UP_QUESTIONS": ["Can you summarize file1.pdf?"], "PREVIOUS_CONVERSATION": "{prev_conv}", "SOURCES": [{{ "id": "1", "filename": "file1.pdf" }}] }}
-
-    DOCUMENTS: {doc_context_block}
-    QUESTION: {request.question}
-    """
-    # print(prompt)
-    llm_resp = chat_completion(
-        openai_client,
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "Return ONLY valid JSON matching the required schema."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.4,
-        max_tokens=900
-    )
-    raw_content = llm_resp.choices[0].message.content.strip()
+DOCUMENTS: {doc_context_block}
 
+QUESTION: {request.question}"""
+    # Lazy %-args: nothing is formatted unless DEBUG is enabled
+    logger.debug("document prompt: %s", prompt)
+    messages = [
+        {"role": "system", "content": DOCUMENT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    return messages, doc_tags
+
+# Compiled once: every document answer goes through these
+_CODE_FENCE_LINE_RE = re.compile(r"^[ \t]*```.*(?:\n|$)", re.MULTILINE)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+_LIST_MARKER_RE = re.compile(r"^\s*\d+[.)]\s+")
+
+def _extract_json(txt: str) -> str:
+    # Strip code fences if present (every fence line, in one regex pass)
+    if txt.startswith("```"):
+        txt = _CODE_FENCE_LINE_RE.sub("", txt).strip()
+    # Heuristic: grab from first { to last }
+    start = txt.find("{")
+    end = txt.rfind("}")
+    if start != -1 and end != -1:
+        return txt[start:end+1]
+    return txt
+
+def parse_document_answer(raw_content: str, doc_tags: List[str]) -> Tuple[str, List[str], List[dict], bool, List[dict]]:
+    """Parse the model's JSON reply to the document prompt into (answer, follow_ups, tags, has_answer, file_names)."""
     # ---------- JSON extraction / normalization ----------
-    def extract_json(txt: str) -> str:
-        # Strip code fences if present
-        if txt.startswith("```"):
-            # remove first and last fence
-            lines = [l for l in txt.splitlines() if not l.strip().startswith("```")]
-            txt = "\n".join(lines).strip()
-        # Heuristic: grab from first { to last }
-        if "{" in txt and "}" in txt:
-            start = txt.find("{")
-            end = txt.rfind("}")
-            return txt[start:end+1]
-        return txt
-
     parsed = {}
-    json_str = extract_json(raw_content)
+    json_str = _extract_json(raw_content)
     try:
-        parsed = json.loads(json_str)
+        parsed = orjson.loads(json_str)
     except Exception:
         # Fallback: attempt to fix common trailing commas
         try:
-            json_str_fixed = re.sub(r",(\s*[}\]])", r"\1", json_str)
-            parsed = json.loads(json_str_fixed)
+            json_str_fixed = _TRAILING_COMMA_RE.sub(r"\1", json_str)
+            parsed = orjson.loads(json_str_fixed)
         except Exception:
             parsed = {}
 
@@ -161,7 +249,8 @@ def document_search(doc_ids: List[str], request: QuestionRequest, chat_context:
 
     fq_field = parsed.get("FOLLOW_UP_QUESTIONS")
     if isinstance(fq_field, list):
-        follow_up_questions = [str(x).strip() for x in fq_field if str(x).strip()][:3]
+        # Drop "1." / "2)" list markers the model sometimes adds despite the schema
+        follow_up_questions = [q for q in (_LIST_MARKER_RE.sub("", str(x)).strip() for x in fq_field) if q][:3]
 
     # Fallbacks if JSON failed
     if not parsed:
@@ -178,26 +267,161 @@ def document_search(doc_ids: List[str], request: QuestionRequest, chat_context:
     file_names = [{"filename": str(n).strip(), "file_url": ""} for n in doc_tags if str(n).strip()]
     return answer_text, follow_up_questions, tags, has_answer , file_names
 
-def vector_search(request: QuestionRequest, chat_context: str, openai_client, collection) -> Tuple[str, List[str], List[str], str]:
-    query_embedding = get_embedding(request.question, openai_client)
-    vector_index = os.getenv("VECTOR_INDEX_NAME", "questions_index")
+async def document_search(docs: List[dict], request: QuestionRequest, chat_context: str, openai_client) -> Tuple[str, List[str], List[dict], bool, List[dict]]:
+    messages, doc_tags = build_document_messages(docs, request, chat_context)
+    llm_resp = await chat_completion(
+        openai_client,
+        model="gpt-4o",
+        messages=messages,
+        temperature=0.4,
+        max_tokens=900
+    )
+    return parse_document_answer(llm_resp.choices[0].message.content.strip(), doc_tags)
 
-    # Use limited chat context for tone only
-    chat_context_limited = _limit_chat_context(chat_context)
-    if not chat_context_limited:
-        prev_conv_block = "None"
-    else:
-        prev_conv_block = chat_context_limited
-        # Add explicit truncation notice if we actually trimmed
-        if chat_context and chat_context_limited != chat_context:
-            prev_conv_block += "\n[... truncated ...]"
+class AnswerFieldStream:
+    """
+    Incrementally decode the ANSWER value of the document-answer JSON while it streams.
+    feed() takes raw model deltas and returns the newly available answer text
+    (a string value as-is, list items joined by newlines like parse_document_answer).
+    It is for display only: the final answer still comes from parse_document_answer.
+    """
+    _KEY = '"ANSWER"'
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._state = "key"  # key -> colon -> value -> string/list ... -> done
+        self._in_list = False
+        self._items = 0
+
+    def _skip_ws(self) -> bool:
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+        self._pos = pos
+        return pos < len(buf)
+
+    def feed(self, chunk: str) -> str:
+        self._buf += chunk
+        buf = self._buf
+        out: List[str] = []
+        while self._state != "done":
+            if self._state == "key":
+                i = buf.find(self._KEY, self._pos)
+                if i < 0:
+                    # keep a tail long enough to match a key split across chunks
+                    self._pos = max(self._pos, len(buf) - len(self._KEY) + 1)
+                    break
+                self._pos = i + len(self._KEY)
+                self._state = "colon"
+            elif self._state == "colon":
+                if not self._skip_ws():
+                    break
+                if buf[self._pos] == ":":
+                    self._pos += 1
+                    self._state = "value"
+                else:
+                    self._state = "key"
+            elif self._state in ("value", "list"):
+                if not self._skip_ws():
+                    break
+                c = buf[self._pos]
+                self._pos += 1
+                if self._state == "list" and c == ",":
+                    continue
+                if c == '"':
+                    if self._items:
+                        out.append("\n")
+                    self._state = "string"
+                elif c == "[" and self._state == "value":
+                    self._in_list = True
+                    self._state = "list"
+                else:
+                    self._state = "done"
+            else:  # string
+                pos = self._pos
+                end = len(buf)
+                q = buf.find('"', pos)
+                b = buf.find("\\", pos)
+                stop = min(x for x in (q, b, end) if x >= 0)
+                if stop > pos:
+                    out.append(buf[pos:stop])
+                    self._pos = pos = stop
+                if pos >= end:
+                    break
+                if buf[pos] == '"':
+                    self._pos += 1
+                    self._items += 1
+                    self._state = "list" if self._in_list else "done"
+                    continue
+                # escape sequence; wait for the rest of it if it is split across chunks
+                if pos + 1 >= end:
+                    break
+                esc = buf[pos + 1]
+                if esc != "u":
+                    out.append(self._ESCAPES.get(esc, esc))
+                    self._pos = pos + 2
+                    continue
+                if pos + 6 > end:
+                    break
+                try:
+                    cp = int(buf[pos + 2:pos + 6], 16)
+                    if 0xD800 <= cp < 0xDC00:
+                        # surrogate pair: needs the following \uXXXX too
+                        if pos + 12 > end:
+                            break
+                        low = int(buf[pos + 8:pos + 12], 16)
+                        cp = 0x10000 + ((cp - 0xD800) << 10) + (low - 0xDC00)
+                        self._pos = pos + 12
+                    else:
+                        self._pos = pos + 6
+                except ValueError:
+                    # malformed escape: stop streaming, the final parse decides
+                    self._state = "done"
+                    break
+                out.append(chr(cp))
+        return "".join(out)
+
+# HNSW candidates examined per query; ~20x the limit keeps recall while traversing far less of the graph
+VECTOR_NUM_CANDIDATES = int(os.getenv("VECTOR_NUM_CANDIDATES", "50"))
+
+VECTOR_FALLBACK_ANSWER = "I cannot answer based on stored knowledge: no relevant indexed documents were found. You may upload a document related to your question."
+
+# Query embeddings: per-process LRU in front of the shared Redis cache, OpenAI on a miss of both
+EMBEDDING_LRU_SIZE = int(os.getenv("EMBEDDING_LRU_SIZE", "256"))
+_embedding_lru: "OrderedDict[str, array]" = OrderedDict()
+
+async def embed_question(question: str, openai_client) -> List[float]:
+    vec = _embedding_lru.get(question)
+    if vec is not None:
+        _embedding_lru.move_to_end(question)
+        return vec.tolist()
+
+    vec = await get_cached_embedding(EMBEDDING_MODEL, question)
+    if vec is None:
+        vec = array("f", await get_embedding_async(question, openai_client))
+        await cache_embedding(EMBEDDING_MODEL, question, vec)
+
+    _embedding_lru[question] = vec
+    if len(_embedding_lru) > EMBEDDING_LRU_SIZE:
+        _embedding_lru.popitem(last=False)
+    return vec.tolist()
+
+async def find_best_match(request: QuestionRequest, openai_client, collection) -> Optional[dict]:
+    """
+    Embed the question and return the best knowledge_bank match above the similarity cutoff (or None).
+    openai_client is an AsyncOpenAI client, collection a Motor collection.
+    """
+    query_embedding = await embed_question(request.question, openai_client)
+    vector_index = os.getenv("VECTOR_INDEX_NAME", "questions_index")
 
     pipeline = [
         {"$vectorSearch": {
             "index": vector_index,
             "path": "question_embedding",
             "queryVector": query_embedding,
-            "numCandidates": 10000,
+            "numCandidates": VECTOR_NUM_CANDIDATES,
             "limit": 1
         }},
         {"$addFields": {"similarity_score": {"$meta": "vectorSearchScore"}}},
@@ -215,73 +439,43 @@ def vector_search(request: QuestionRequest, chat_context: str, openai_client, co
 
         }}
     ]
-    results = list(collection.aggregate(pipeline))
-
-    if not results:
-        # Always return a 4‑tuple
-        fallback = "I cannot answer based on stored knowledge: no relevant indexed documents were found. You may upload a document related to your question."
-        return fallback, [], [], ""
-
-    best = results[0]
-
-    raw_tags = best.get("tags", [])
-    names: List[str] = []
-
-    # Normalize tags to a list of names
-    if isinstance(raw_tags, list):
-        for t in raw_tags:
-            if isinstance(t, dict):
-                v = t.get("name") or t.get("filename") or t.get("file_name") or t.get("tag")
-                if isinstance(v, list):
-                    names.extend(str(x).strip() for x in v if str(x).strip())
-                elif v:
-                    names.append(str(v).strip())
-            else:
-                s = str(t).strip()
-                if s:
-                    names.append(s)
-    elif isinstance(raw_tags, str):
-        s = raw_tags.strip()
-        if s.startswith("[") and s.endswith("]"):
-            try:
-                parsed = ast.literal_eval(s)
-                if isinstance(parsed, (list, tuple)):
-                    for x in parsed:
-                        names.append(str(x).strip())
-            except Exception:
-                pass
-        else:
-            names.extend([p.strip() for p in s.split(",") if p.strip()])
+    results = await collection.aggregate(pipeline).to_list(1)
+    return results[0] if results else None
 
-    follow_up_questions: List[str] = []
-    for i in range(1, 4):
-        k = f"follow_up_question_{i}"
-        if best.get(k):
-            follow_up_questions.append(best[k])
+# Static instructions for knowledge-bank answers (see DOCUMENT_SYSTEM_PROMPT)
+VECTOR_SYSTEM_PROMPT = """Helpful, precise, no hallucinations.
 
-    # IMPORTANT: use the LIMITED previous conversation (prev_conv_block) not the full chat_context
-    prompt = f"""
-You are acting as a conversational agent for a high-value client demonstration. 
+You are acting as a conversational agent for a high-value client demonstration.
 Your goal is to synthesize the provided context into a detailed and professional answer.
 
 ### Instructions:
-1. **Content Source Priority:** 
-   - The response MUST be generated directly and entirely from the 'Retrieved answer (context)' provided below. 
+1. **Content Source Priority:**
+   - The response MUST be generated directly and entirely from the 'Retrieved answer (context)' in the user message.
    - Treat this as the sole authoritative source. Do NOT use outside knowledge or inference.
-2. **Formatting Requirement:** 
-   - The final answer MUST be structured as a comprehensive numbered list. 
+2. **Formatting Requirement:**
+   - The final answer MUST be structured as a comprehensive numbered list.
    - Each distinct fact, step, or component of the answer MUST be its own numbered point.
    - Use professional, precise wording; avoid fluff or repetition.
-3. **Previous Conversation Usage:** 
-   - Use the 'Previous conversation' only to maintain conversational continuity or flow. 
-   - Do NOT add new content from it; only minor adjustments for tone or context.
+3. **Previous Conversation Usage:**
+   - Use the 'Previous conversation' only to maintain conversational continuity or flow.
+   - Do NOT add new content from it; only minor adjustments for tone or context."""
 
----
+def build_vector_messages(request: QuestionRequest, chat_context: str, best: dict) -> List[dict]:
+    # Use limited chat context for tone only
+    chat_context_limited = _limit_chat_context(chat_context)
+    if not chat_context_limited:
+        prev_conv_block = "None"
+    else:
+        prev_conv_block = chat_context_limited
+        # Add explicit truncation notice if we actually trimmed
+        if chat_context and chat_context_limited != chat_context:
+            prev_conv_block += "\n[... truncated ...]"
 
-**Previous conversation:**
-{chat_context}
+    # IMPORTANT: use the LIMITED previous conversation (prev_conv_block) not the full chat_context
+    prompt = f"""**Previous conversation:**
+{prev_conv_block}
 
-**Current user question:** 
+**Current user question:**
 {request.question}
 
 **Retrieved answer (context):**
@@ -289,34 +483,49 @@ Your goal is to synthesize the provided context into a detailed and professional
 
 ---
 
-**Your detailed, numbered answer:**
-"""
-    # print(prompt)
+**Your detailed, numbered answer:**"""
+    logger.debug("vector prompt: %s", prompt)
+    return [
+        {"role": "system", "content": VECTOR_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
 
-    llm_resp = chat_completion(
-        openai_client,
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "Helpful, precise, no hallucinations."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.7,
-        max_tokens=600
-    )
-    final_answer = llm_resp.choices[0].message.content.strip()
+def vector_result_metadata(best: dict) -> Tuple[List[str], List[dict], str, List[dict]]:
+    """Follow-ups, tags, file_url and file_names for a knowledge_bank match."""
+    follow_up_questions: List[str] = []
+    for i in range(1, 4):
+        k = f"follow_up_question_{i}"
+        if best.get(k):
+            follow_up_questions.append(best[k])
 
     # Build tags as list of objects and return file_url separately
     file_url = best.get("file_url", "") or ""
-    tags = best.get("tags", [])
+    # knowledge_bank stores tags as [{"names": [...]}]: read the array as-is, nothing to parse
+    tags = best.get("tags") or []
     final_tags: List[dict] = []
     file_names = []
-    names = tags[0].get("names",[])
+    names = tags[0].get("names", []) if isinstance(tags, list) and tags and isinstance(tags[0], dict) else []
     for name in names:
         if name.endswith(".pdf"):
             final_tags.append({"name":name, "file_url": data1["filenames"].get(name, "")})
             file_names.append({"filename":name, "file_url": data1["filenames"].get(name, "")})
         else:
             final_tags.append({"name":name, "file_url":""})
-    # print(final_tags)
 
-    return final_answer, follow_up_questions, final_tags, file_url, file_names
\ No newline at end of file
+    return follow_up_questions, final_tags, file_url, file_names
+
+async def vector_search(request: QuestionRequest, chat_context: str, openai_client, collection) -> Tuple[str, List[str], List[dict], str, List[dict]]:
+    best = await find_best_match(request, openai_client, collection)
+    if best is None:
+        return VECTOR_FALLBACK_ANSWER, [], [], "", []
+
+    llm_resp = await chat_completion(
+        openai_client,
+        model="gpt-4o",
+        messages=build_vector_messages(request, chat_context, best),
+        temperature=0.7,
+        max_tokens=600
+    )
+    final_answer = llm_resp.choices[0].message.content.strip()
+    follow_up_questions, final_tags, file_url, file_names = vector_result_metadata(best)
+    return final_answer, follow_up_questions, final_tags, file_url, file_names
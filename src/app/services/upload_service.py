@@ -1,41 +1,243 @@
 from datetime import datetime
-import hashlib
+import asyncio
+import contextlib
 import io
-from typing import Dict
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from blake3 import blake3
 from dotenv import load_dotenv
 from fastapi import HTTPException, UploadFile
-from pdfminer.high_level import extract_text as extract_pdf_text
-from docx import Document
-from ..services.openai_service import get_client
-from ..services.mongo_service import connect_to_mongodb
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from ..services.mongo_service import get_collection, compress_text
 
 load_dotenv()
-openai_client = get_client()
 
 document_store: Dict[str, Dict] = {}
 
-async def process_document(file: UploadFile) -> str:
-    """Process uploaded document and store its content (avoid re-inserting duplicates in MongoDB)"""
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt')
+
+# PDF/DOCX libraries are heavy imports; load them on first use of each format
+
+@lru_cache(maxsize=1)
+def _pdf_resource_manager():
+    # One resource manager per process: its font/CMap cache is reused across pages and PDFs
+    from pdfminer.pdfinterp import PDFResourceManager
+    return PDFResourceManager(caching=True)
+
+@lru_cache(maxsize=1)
+def _text_only_interpreter_class():
+    """
+    PDFPageInterpreter that ignores path construction, painting, clipping and
+    shading operators. Only text is kept, and on drawing-heavy pages those
+    operators dominate interpretation and layout time.
+    """
+    from pdfminer.pdfinterp import PDFPageInterpreter
+
+    class TextOnlyPDFPageInterpreter(PDFPageInterpreter):
+        # Argument counts must match the base methods: the interpreter pops that many operands
+        def do_m(self, x, y): pass
+        def do_l(self, x, y): pass
+        def do_c(self, x1, y1, x2, y2, x3, y3): pass
+        def do_v(self, x2, y2, x3, y3): pass
+        def do_y(self, x1, y1, x3, y3): pass
+        def do_h(self): pass
+        def do_re(self, x, y, w, h): pass
+        def do_S(self): pass
+        def do_s(self): pass
+        def do_f(self): pass
+        def do_F(self): pass
+        def do_f_a(self): pass
+        def do_B(self): pass
+        def do_B_a(self): pass
+        def do_b(self): pass
+        def do_b_a(self): pass
+        def do_n(self): pass
+        def do_W(self): pass
+        def do_W_a(self): pass
+        def do_sh(self, name): pass
+
+    return TextOnlyPDFPageInterpreter
+
+@lru_cache(maxsize=1)
+def _fitz():
+    import fitz  # PyMuPDF
+    return fitz
+
+@lru_cache(maxsize=1)
+def _docx_document_class():
+    from docx import Document
+    return Document
+
+# "pymupdf" (default, several times faster) or "pdfminer"
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pymupdf").lower()
+
+def extract_pdf_text_pymupdf(path: str) -> str:
+    with _fitz().open(path, filetype="pdf") as doc:
+        # "text" mode only walks text; drawings and images are never materialised
+        return "\n".join(page.get_text("text") for page in doc)
+
+def extract_pdf_text(fp) -> str:
+    """pdfminer.high_level.extract_text equivalent using the shared resource manager and a text-only interpreter."""
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfpage import PDFPage
+
+    rsrcmgr = _pdf_resource_manager()
+    output = io.StringIO()
+    device = TextConverter(rsrcmgr, output, laparams=LAParams())
     try:
-        content = await file.read()
+        interpreter = _text_only_interpreter_class()(rsrcmgr, device)
+        for page in PDFPage.get_pages(fp, caching=True):
+            interpreter.process_page(page)
+    finally:
+        device.close()
+    return output.getvalue()
+
+# Text extraction is CPU-bound: run it in worker processes, off the event loop
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+_extract_executor: Optional[ProcessPoolExecutor] = None
+
+def _warm_extractor() -> None:
+    """Worker initializer: pay the PDF/DOCX import cost at startup, not on the first upload."""
+    try:
+        if PDF_BACKEND == "pymupdf":
+            _fitz()
+        _pdf_resource_manager()
+        _text_only_interpreter_class()
+        _docx_document_class()
+    except Exception:
+        pass  # a missing backend surfaces (or falls back) on first use instead
+
+def get_extract_executor() -> ProcessPoolExecutor:
+    global _extract_executor
+    if _extract_executor is None:
+        _extract_executor = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, initializer=_warm_extractor)
+    return _extract_executor
 
-        # Generate unique document ID (hash of bytes)
-        doc_id = hashlib.md5(content).hexdigest()
+def start_extract_executor() -> None:
+    """Create the pool and have its workers spawn (and warm up) now rather than on the first upload."""
+    executor = get_extract_executor()
+    for _ in range(EXTRACT_WORKERS):
+        executor.submit(int)  # trivial task; spawning the worker runs _warm_extractor
+
+def shutdown_extract_executor() -> None:
+    global _extract_executor
+    if _extract_executor is not None:
+        _extract_executor.shutdown(wait=False, cancel_futures=True)
+        _extract_executor = None
+
+def _extract_text(lname: str, path: str) -> str:
+    """Extract plain text from an uploaded file on disk based on the (lower-cased) file name."""
+    if lname.endswith('.pdf'):
+        if PDF_BACKEND == "pymupdf":
+            try:
+                return extract_pdf_text_pymupdf(path)
+            except Exception:
+                pass  # fall back to pdfminer for files PyMuPDF can't handle
+        with open(path, 'rb') as fp:
+            return extract_pdf_text(fp)
+    if lname.endswith('.docx'):
+        doc = _docx_document_class()(path)
+        return '\n'.join([p.text for p in doc.paragraphs])
+    if lname.endswith('.txt'):
+        with open(path, 'r', encoding='utf-8') as fp:
+            return fp.read()
+    raise HTTPException(status_code=400, detail="Unsupported file format")
+
+# Uploads are copied to disk in chunks of this size, never held in memory whole
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+async def _spool_upload(file: UploadFile, suffix: str) -> Tuple[str, str]:
+    """
+    Copy an upload into a named temp file chunk by chunk, hashing as it goes.
+    Returns (doc_id, path); the caller removes the file.
+    """
+    # BLAKE3 (SIMD) truncated to 128 bits: same 32-hex id shape as the old MD5 ids
+    digest = blake3()
+    # Creating, writing and closing the temp file are blocking disk I/O: done in a thread,
+    # together with hashing the chunk, so large uploads don't stall the event loop
+    tmp = await asyncio.to_thread(tempfile.NamedTemporaryFile, suffix=suffix, delete=False)
+    try:
+        try:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await asyncio.to_thread(_hash_and_write, digest, tmp, chunk)
+        finally:
+            await asyncio.to_thread(tmp.close)
+    except BaseException:
+        _remove_file(tmp.name)
+        raise
+    return digest.hexdigest(length=16), tmp.name
+
+def _hash_and_write(digest, tmp, chunk: bytes) -> None:
+    digest.update(chunk)
+    tmp.write(chunk)
+
+def _remove_file(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+# Stored-record fields kept in document_store; the text itself stays in Mongo
+_STORED_PROJECTION = {"_id": 0, "file_name": 1, "created_date": 1}
+
+def _remember_stored(doc_id: str, record: dict, fname: str) -> None:
+    document_store[doc_id] = {
+        'filename': record.get("file_name") or fname,
+        'upload_time': record.get("created_date"),
+        'saved_to_mongo': True
+    }
+
+async def _remember_stored_record(collection, doc_id: str, fname: str) -> None:
+    """Another upload stored these bytes first: keep its file name and date, not this upload's."""
+    try:
+        record = await collection.find_one({"id": doc_id}, _STORED_PROJECTION)
+    except Exception:
+        record = None
+    if record:
+        _remember_stored(doc_id, record, fname)
+    else:
+        document_store[doc_id]["saved_to_mongo"] = True
 
-        # Extract text based on file type
-        text = ""
+async def process_document(file: UploadFile) -> str:
+    """Process uploaded document and store its content (duplicates are detected by content hash)"""
+    path = None
+    try:
         fname = file.filename or ""
         lname = fname.lower()
-        if lname.endswith('.pdf'):
-            text = extract_pdf_text(io.BytesIO(content))
-        elif lname.endswith('.docx'):
-            doc = Document(io.BytesIO(content))
-            text = '\n'.join([p.text for p in doc.paragraphs])
-        elif lname.endswith('.txt'):
-            text = content.decode('utf-8')
-        else:
+        if not lname.endswith(SUPPORTED_EXTENSIONS):
             raise HTTPException(status_code=400, detail="Unsupported file format")
 
+        # Generate unique document ID (hash of bytes) while spooling the upload to disk
+        doc_id, path = await _spool_upload(file, os.path.splitext(lname)[1])
+
+        # Same bytes already stored by this worker: nothing to do
+        cached = document_store.get(doc_id)
+        if cached and cached.get("saved_to_mongo"):
+            return doc_id
+
+        # Content-hash dedupe against already stored documents, before paying for extraction
+        collection = get_collection("upload")
+        if collection is not None:
+            try:
+                existing = await collection.find_one({"id": doc_id}, _STORED_PROJECTION)
+            except Exception:
+                existing = None
+            if existing:
+                _remember_stored(doc_id, existing, fname)
+                return doc_id
+
+        # CPU-bound extraction runs in the process pool; workers read the temp file directly
+        loop = asyncio.get_running_loop()
+        text = await loop.run_in_executor(get_extract_executor(), _extract_text, lname, path)
+
         created_date = datetime.utcnow().isoformat()
         document_store[doc_id] = {
             'filename': fname,
@@ -43,34 +245,128 @@ async def process_document(file: UploadFile) -> str:
             'content': text
         }
 
-        # Persist document into MongoDB collection "upload" only if not already present
-        mongo_client, collection = connect_to_mongodb("upload")
-        if mongo_client is not None and collection is not None:
+        # Persist into MongoDB collection "upload": the upsert inserts, and is a no-op if a
+        # concurrent upload of the same bytes stored them since the check above
+        if collection is not None:
             try:
-                existing = collection.find_one({"id": doc_id})
-                if existing:
-                    # already stored
-                    document_store[doc_id]["saved_to_mongo"] = True
-                else:
-                    doc_record = {
+                result = await collection.update_one(
+                    {"id": doc_id},
+                    {"$setOnInsert": {
                         "file_name": fname,
-                        "text": text,
+                        "text": compress_text(text),
                         "id": doc_id,
                         "created_date": created_date
-                    }
-                    collection.insert_one(doc_record)
+                    }},
+                    upsert=True
+                )
+                if result.upserted_id is None:
+                    await _remember_stored_record(collection, doc_id, fname)
+                else:
                     document_store[doc_id]["saved_to_mongo"] = True
+            except DuplicateKeyError:
+                # A concurrent upsert of the same bytes won the unique index; it's stored
+                await _remember_stored_record(collection, doc_id, fname)
             except Exception:
                 # on failure, keep in-memory copy but mark not saved
                 document_store[doc_id]["saved_to_mongo"] = False
-            finally:
-                try:
-                    mongo_client.close()
-                except Exception:
-                    pass
         return doc_id
 
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+    finally:
+        if path:
+            _remove_file(path)
+
+async def process_documents(files: List[UploadFile], extract_slots: Optional[asyncio.Semaphore] = None) -> List[str]:
+    """
+    Batch variant of process_document: one Mongo lookup for the whole batch,
+    concurrent extraction, and a single unordered bulk upsert.
+    Each extraction holds a slot of extract_slots (if given) while it runs, so one
+    batch counts against the same concurrency limit as that many single uploads.
+    Returns the document ids in upload order.
+    """
+    paths: List[str] = []
+    try:
+        for file in files:
+            if not (file.filename or "").lower().endswith(SUPPORTED_EXTENSIONS):
+                raise HTTPException(status_code=400, detail=f"Unsupported file format: {file.filename or ''}")
+
+        items = []
+        for file in files:
+            fname = file.filename or ""
+            lname = fname.lower()
+            doc_id, path = await _spool_upload(file, os.path.splitext(lname)[1])
+            paths.append(path)
+            items.append((doc_id, fname, lname, path))
+        doc_ids = [doc_id for doc_id, _, _, _ in items]
+
+        # Unique, not already stored by this worker
+        pending = {}
+        for doc_id, fname, lname, path in items:
+            cached = document_store.get(doc_id)
+            if doc_id not in pending and not (cached and cached.get("saved_to_mongo")):
+                pending[doc_id] = (fname, lname, path)
+        if not pending:
+            return doc_ids
+
+        collection = get_collection("upload")
+        if collection is not None:
+            try:
+                stored = collection.find({"id": {"$in": list(pending)}}, {"_id": 0, "id": 1})
+                async for d in stored:
+                    pending.pop(d["id"], None)
+            except Exception:
+                pass
+
+        pending_ids = list(pending)
+        loop = asyncio.get_running_loop()
+        executor = get_extract_executor()
+
+        async def extract(lname: str, path: str) -> str:
+            async with extract_slots or contextlib.nullcontext():
+                return await loop.run_in_executor(executor, _extract_text, lname, path)
+
+        texts = await asyncio.gather(*(
+            extract(lname, path) for fname, lname, path in pending.values()
+        ))
+
+        created_date = datetime.utcnow().isoformat()
+        ops = []
+        for doc_id, text in zip(pending_ids, texts):
+            fname = pending[doc_id][0]
+            document_store[doc_id] = {
+                'filename': fname,
+                'upload_time': created_date,
+                'content': text
+            }
+            ops.append(UpdateOne(
+                {"id": doc_id},
+                {"$setOnInsert": {
+                    "file_name": fname,
+                    "text": compress_text(text),
+                    "id": doc_id,
+                    "created_date": created_date
+                }},
+                upsert=True
+            ))
+
+        saved = False
+        if ops and collection is not None:
+            try:
+                await collection.bulk_write(ops, ordered=False)
+                saved = True
+            except Exception:
+                saved = False
+        for doc_id in pending_ids:
+            document_store[doc_id]["saved_to_mongo"] = saved
+        return doc_ids
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
+    finally:
+        for path in paths:
+            _remove_file(path)
@@ -1,4 +1,4 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
 import os
 from openai import OpenAI
@@ -16,18 +16,33 @@ def connect_to_mongodb():
         print(f"Error connecting to MongoDB: {str(e)}")
         return None, None
 
-def get_embedding(text, model="text-embedding-ada-002", client=None):
-    """Get embedding for a text using OpenAI API"""
+# Questions embedded per OpenAI request (the endpoint accepts up to 2048 inputs)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+
+def get_embeddings(texts, model="text-embedding-ada-002", client=None):
+    """Get embeddings for a list of texts in one OpenAI API call (same order as texts)"""
     try:
         response = client.embeddings.create(
             model=model,
-            input=text
+            input=texts
         )
-        return response.data[0].embedding
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
     except Exception as e:
-        print(f"Error getting embedding: {str(e)}")
+        print(f"Error getting embeddings: {str(e)}")
         return None
 
+def _embed_batch(batch, collection, openai_client):
+    """Embed a batch of (_id, question) pairs and write them back in one bulk write"""
+    embeddings = get_embeddings([q for _, q in batch], client=openai_client)
+    if not embeddings:
+        return
+    collection.bulk_write([
+        UpdateOne({'_id': doc_id}, {'$set': {'question_embedding': emb}})
+        for (doc_id, _), emb in zip(batch, embeddings)
+    ], ordered=False)
+    for doc_id, _ in batch:
+        print(f"Updated embedding for document {doc_id}")
+
 def process_questions_and_create_embeddings():
     """Process only main user questions and create embeddings"""
     # Load environment variables
@@ -42,23 +57,21 @@ def process_questions_and_create_embeddings():
         return
     
     try:
-        # Get all documents from the collection
-        documents = collection.find({})
+        # Get all documents from the collection (only the fields needed here)
+        documents = collection.find({}, {'user_question_short': 1})
         
+        batch = []
         for doc in documents:
             # Generate embedding only for main question
             if 'user_question_short' in doc:
-                main_q_embedding = get_embedding(doc['user_question_short'], client=openai_client)
-                if main_q_embedding:
-                    # Update document with only the main question embedding
-                    collection.update_one(
-                        {'_id': doc['_id']},
-                        {'$set': {'question_embedding': main_q_embedding}}
-                    )
-                    print(f"Updated embedding for document {doc['_id']}")
-            
-            # Sleep briefly to respect API rate limits
-            time.sleep(0.5)
+                batch.append((doc['_id'], doc['user_question_short']))
+            if len(batch) >= EMBEDDING_BATCH_SIZE:
+                _embed_batch(batch, collection, openai_client)
+                batch = []
+                # Sleep briefly to respect API rate limits
+                time.sleep(0.5)
+        if batch:
+            _embed_batch(batch, collection, openai_client)
         
         print("Completed processing all documents")
         
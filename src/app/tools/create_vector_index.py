@@ -0,0 +1,50 @@
+from pymongo import MongoClient
+from dotenv import load_dotenv
+import os
+
+# Atlas Vector Search index used by search_service.find_best_match ($vectorSearch on knowledge_bank).
+# Scalar quantization keeps an int8 copy of each 1536-dim ada-002 vector for the HNSW graph
+# (~4x less memory to traverse); Atlas rescores with the full-fidelity vectors.
+INDEX_DEFINITION = {
+    "fields": [
+        {
+            "type": "vector",
+            "path": "question_embedding",
+            "numDimensions": 1536,
+            "similarity": "cosine",
+            "quantization": "scalar"
+        }
+    ]
+}
+
+def create_or_update_vector_index():
+    """Create the knowledge_bank vector index, or update an existing one to INDEX_DEFINITION."""
+    load_dotenv()
+    index_name = os.getenv("VECTOR_INDEX_NAME", "questions_index")
+    collection_name = os.getenv("questions_collection_name", "knowledge_bank")
+
+    client = None
+    try:
+        client = MongoClient(os.getenv('mongo_connection_string'))
+        db = client[os.getenv('db_name', 'crda')]
+        existing = {
+            idx["name"]
+            for idx in db[collection_name].aggregate([{"$listSearchIndexes": {}}])
+        }
+        if index_name in existing:
+            db.command({"updateSearchIndex": collection_name, "name": index_name, "definition": INDEX_DEFINITION})
+            print(f"Updated vector index '{index_name}' (Atlas rebuilds it in the background)")
+        else:
+            db.command({
+                "createSearchIndexes": collection_name,
+                "indexes": [{"name": index_name, "type": "vectorSearch", "definition": INDEX_DEFINITION}]
+            })
+            print(f"Created vector index '{index_name}'")
+    except Exception as e:
+        print(f"Error creating vector index: {str(e)}")
+    finally:
+        if client is not None:
+            client.close()
+
+if __name__ == "__main__":
+    create_or_update_vector_index()
@@ -1,9 +1,12 @@
 import json
+import redis
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
+import sys
 import pprint
 import pandas as pd
+from pymongo import UpdateOne
 
 def load_json_data(file_path):
     """Load and return data from a JSON file."""
@@ -34,6 +37,37 @@ def load_excel_data(file_path):
         print(f"Error reading Excel file: {str(e)}")
         return None
 
+def normalize_tags(raw_tags):
+    """Turn the sheet's tag cell ("[a, 'b']" or "a, b") into a list of tag strings."""
+    if isinstance(raw_tags, list):
+        return [str(t).strip() for t in raw_tags if str(t).strip()]
+    if raw_tags is None or (isinstance(raw_tags, float) and pd.isna(raw_tags)):
+        return []
+    raw_tags = str(raw_tags)
+    if raw_tags.startswith("[") and raw_tags.endswith("]"):
+        return [t.strip(" '\"") for t in raw_tags[1:-1].split(",") if t.strip(" '\"")]
+    return [t.strip() for t in raw_tags.split(",") if t.strip()]
+
+def migrate_tags():
+    """One-off: rewrite insights whose tags are still stored as a string into a BSON array."""
+    try:
+        client = MongoClient(os.getenv('mongo_connection_string'))
+        collection = client['crda']['insights']
+        ops = [
+            UpdateOne({'_id': doc['_id']}, {'$set': {'tags': normalize_tags(doc.get('tags'))}})
+            for doc in collection.find({'tags': {'$type': 'string'}}, {'tags': 1})
+        ]
+        if ops:
+            result = collection.bulk_write(ops, ordered=False)
+            print(f"Normalized tags on {result.modified_count} documents")
+        else:
+            print("No string tags left to normalize")
+        client.close()
+        return True
+    except Exception as e:
+        print(f"Error migrating tags: {str(e)}")
+        return False
+
 def save_to_mongodb(transformed_data):
     """Save transformed data to MongoDB."""
     try:
@@ -64,15 +98,39 @@ def save_to_mongodb(transformed_data):
         print(f"Error saving to MongoDB: {str(e)}")
         return False
 
+def invalidate_insights_cache():
+    """Drop the API's cached GET /insights payload so new insights show up immediately."""
+    try:
+        client = redis.Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            db=0
+        )
+        client.delete("insights:list:v1")  # INSIGHTS_CACHE_KEY in src/app/api/insights_api.py
+        client.close()
+    except Exception as e:
+        print(f"Could not invalidate insights cache: {str(e)}")
+
 def main():
     """Main function to orchestrate the data processing pipeline."""
     # Load environment variables
     load_dotenv()
+
+    # python data_ingestion.py --migrate-tags: normalize tags of already ingested insights
+    if "--migrate-tags" in sys.argv[1:]:
+        if migrate_tags():
+            invalidate_insights_cache()
+        return
     
     # Load Excel data
     data = load_excel_data('insights.xlsx')
     if not data:
         return
+
+    # Store tags as an array so the API doesn't re-parse them on every read
+    for row in data:
+        if 'tags' in row:
+            row['tags'] = normalize_tags(row['tags'])
     
     # Print data for verification (first 2 entries)
     print("Data to be inserted:")
@@ -83,6 +141,7 @@ def main():
         success = save_to_mongodb(data)
         if success:
             print("Data successfully saved to MongoDB insights collection")
+            invalidate_insights_cache()
         else:
             print("Failed to save data to MongoDB")
 
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from src.app.services.redis_service import (
+    CHAT_ORDER_ZSET,
+    chat_meta_key,
+    chat_order_member,
+    record_turn,
+    redis_client,
+    redis_key,
+)
+
+
+def _run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            # Connections are bound to this event loop
+            await redis_client.connection_pool.disconnect()
+    return asyncio.run(main())
+
+
+def _redis_available() -> bool:
+    try:
+        return bool(_run(redis_client.ping()))
+    except Exception:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not _redis_available(), reason="needs a Redis server (REDIS_HOST/REDIS_PORT)")
+
+
+def test_record_turn_clears_follow_ups_on_legacy_item():
+    chat_id, chat_type = uuid.uuid4().hex, "question"
+    list_key = redis_key(chat_id, chat_type)
+
+    async def scenario():
+        # Written by the stdlib json module before history items moved to orjson: "key": [ with spaces
+        legacy = json.dumps({
+            "question": "q1",
+            "answer": "a1",
+            "ts": "2024-01-01T00:00:00Z",
+            "tags": [],
+            "document_ids": [],
+            "follow_up_questions": ["f1 [x]", "f2 \"quoted\""]
+        })
+        await redis_client.rpush(list_key, legacy)
+        try:
+            length = await record_turn(
+                chat_id, chat_type, "Title", "q2", "a2", [],
+                extra={"follow_up_questions": ["f3"]}
+            )
+            return length, await redis_client.lrange(list_key, 0, -1)
+        finally:
+            await redis_client.delete(list_key, chat_meta_key(chat_id, chat_type))
+            await redis_client.zrem(CHAT_ORDER_ZSET, chat_order_member(chat_type, chat_id))
+
+    length, items = _run(scenario())
+
+    assert length == 2
+    first, last = (json.loads(i) for i in items)
+    assert first["follow_up_questions"] == []
+    assert first["question"] == "q1" and first["answer"] == "a1"
+    assert last["follow_up_questions"] == ["f3"]